@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class Slot:
+    '''An admitted request, release() must be called once it is done.'''
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self.admission._release()
+
+
+class SlotFile:
+    '''File wrapper that releases a slot once the file is closed.
+
+    The WSGI server closes the file after the response has been sent.
+    '''
+
+    def __init__(self, f, slot):
+        self.f = f
+        self.slot = slot
+
+    def read(self, *args):
+        return self.f.read(*args)
+
+    def close(self):
+        try:
+            self.f.close()
+        finally:
+            self.slot.release()
+
+
+class Admission:
+    '''Admission control for expensive requests.
+
+    At most `slots` expensive requests run at the same time, up to
+    `queue_size` more wait for at most `timeout` seconds for a slot to
+    become free. Anything beyond that is rejected. Cheap requests are never
+    limited.
+
+    The limits apply per process.
+    '''
+
+    def __init__(self, slots, queue_size, timeout, threshold):
+        self.slots = slots
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.threshold = threshold
+
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def is_heavy(self, cost):
+        return cost >= self.threshold
+
+    def acquire(self):
+        '''Wait for a slot, returns None if the request has to be rejected.'''
+        with self._cond:
+            if self.active >= self.slots:
+                if self.waiting >= self.queue_size:
+                    return None
+
+                self.waiting += 1
+                deadline = time.time() + self.timeout
+                try:
+                    while self.active >= self.slots:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return None
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            return Slot(self)
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
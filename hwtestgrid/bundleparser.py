@@ -6,8 +6,37 @@ import shutil
 import json
 import zipfile
 import sys
-
-CURRENT_VERSION = 12
+import bisect
+import hashlib
+
+try:
+    import ijson
+except (ImportError, SyntaxError):
+    # SyntaxError: ijson 3 installed on Python 2
+    ijson = None
+
+CURRENT_VERSION = 15
+
+# sysinfo files stored by content hash, shared between test runs
+ARTIFACTS = ['dmidecode', 'lspci_-vvnn', 'lsusb_-v', 'iw_phy']
+
+# Map device classes to the hwtable entry whose status applies to them
+PCI_CLASS_CATEGORIES = {
+    '0200' : 'ethernet',
+    '0280' : 'wifi',
+    '0300' : 'graphics',
+    '0302' : 'graphics',
+    '0380' : 'graphics',
+    '0c03' : 'usb',
+}
+
+USB_CLASS_CATEGORIES = {
+    'e0' : 'bluetooth',
+}
+
+LSPCI_HEADER = re.compile(r'^(?P<address>\S+) (?P<class_name>[^[]*?)\s*\[(?P<class>[0-9a-fA-F]{4})\]: (?P<description>.*)$')
+LSUSB_HEADER = re.compile(r'^Bus (?P<bus>[0-9]+) Device (?P<dev>[0-9]+): ID (?P<vendor>[0-9a-fA-F]{4}):(?P<device>[0-9a-fA-F]{4})\s*(?P<description>.*)$')
+DEVICE_IDS = re.compile(r'\[(?P<vendor>[0-9a-fA-F]{4}):(?P<device>[0-9a-fA-F]{4})\]')
 
 class HWInfo:
     def __init__(self, t):
@@ -47,6 +76,39 @@ class GBB:
             energy_use_per_ms = (dt1['energy'] - dt2['energy']) / float(dt2['time-ms'] - dt1['time-ms'])
             self.estimated_life = data['log'][0]['energy-full-design'] / energy_use_per_ms / 1000
 
+TESTS_DIR = os.path.join(os.path.dirname(__file__), 'fedora-laptop-testing', 'tests')
+
+_docstrings = {}
+
+def get_docstrings(fname):
+    '''Return the class docstrings of a test file, it is only parsed once.'''
+    if fname in _docstrings:
+        return _docstrings[fname]
+
+    import ast
+    docs = {}
+    try:
+        with open(os.path.join(TESTS_DIR, fname)) as f:
+            mod = ast.parse(f.read(), fname)
+    except IOError:
+        mod = None
+
+    if mod is not None:
+        for statement in mod.body:
+            if isinstance(statement, ast.ClassDef) and statement.name not in docs:
+                docs[statement.name] = ast.get_docstring(statement)
+
+    _docstrings[fname] = docs
+    return docs
+
+def load_docstrings():
+    '''Parse all test files up front.'''
+    if not os.path.isdir(TESTS_DIR):
+        return
+    for fname in os.listdir(TESTS_DIR):
+        if fname.endswith('.py'):
+            get_docstrings(fname)
+
 class TestCase:
     def __init__(self, test, data, directory):
         self.test = test
@@ -82,24 +144,13 @@ class TestCase:
         return 'WARN'
 
     def _get_docstring(self):
-        import ast
         match = re.match(r'.*/(?P<file>.*):(?P<class>.*)\.(?P<func>.*)', self.data['test'])
 
         fname = match.group('file')
         tclass = match.group('class')
         tfunc = match.group('func')
 
-        try:
-            f = open(os.path.join(os.path.dirname(__file__), 'fedora-laptop-testing', 'tests', fname))
-        except IOError:
-            return ''
-
-        mod = ast.parse(f.read(), fname)
-        for statement in mod.body:
-            if not isinstance(statement, ast.ClassDef) or statement.name != tclass:
-                continue
-            return ast.get_docstring(statement)
-        return ''
+        return get_docstrings(fname).get(tclass, '')
 
     @property
     def status(self):
@@ -156,11 +207,227 @@ class HWInfo:
             return 'WARN'
         return 'GOOD'
 
+def artifact_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class DBusIndex:
+    '''Object path index over a D-Bus dump.
+
+    The dump maps service names to object paths to objects. Object paths are
+    kept sorted so that a prefix query is a bisection followed by a scan over
+    the matching paths only. Objects are additionally indexed by the
+    interfaces they implement.
+    '''
+
+    def __init__(self):
+        self.objects = {}
+        self.services = {}
+        self.interfaces = {}
+        self._paths = None
+
+    def __len__(self):
+        return len(self.objects)
+
+    def add_service(self, service, objects):
+        for obj_path, obj in objects.items():
+            self.objects[obj_path] = obj
+            self.services[obj_path] = service
+            for interface in (obj.get('interfaces', None) or {}):
+                self.interfaces.setdefault(interface, set()).add(obj_path)
+        self._paths = None
+
+    @classmethod
+    def load(cls, f):
+        '''Build the index from a file object containing the JSON dump.
+
+        If ijson is available the dump is decoded one service at a time,
+        otherwise it is decoded in one go.
+        '''
+        index = cls()
+        if ijson is not None:
+            for service, objects in ijson.kvitems(f, ''):
+                index.add_service(service, objects)
+        else:
+            for service, objects in json.load(f).items():
+                index.add_service(service, objects)
+        return index
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = sorted(self.objects.keys())
+        return self._paths
+
+    def find_objects(self, prefix):
+        res = {}
+        paths = self.paths
+        i = bisect.bisect_left(paths, prefix)
+        while i < len(paths) and paths[i].startswith(prefix):
+            res[paths[i]] = self.objects[paths[i]]
+            i += 1
+        return res
+
+    def find_interface(self, interface, prefix=''):
+        res = {}
+        for obj_path in sorted(self.interfaces.get(interface, ())):
+            if obj_path.startswith(prefix):
+                res[obj_path] = self.objects[obj_path]
+        return res
+
+def _new_device(bus, address, dev_class, vendor, device, description):
+    return {
+        'bus' : bus,
+        'address' : address,
+        'class' : dev_class.lower(),
+        'vendor' : vendor.lower(),
+        'device' : device.lower(),
+        'subvendor' : None,
+        'subdevice' : None,
+        'driver' : None,
+        'description' : description.strip(),
+    }
+
+def parse_lspci(lspci):
+    '''Split the output of ``lspci -vvnn`` into one record per device.
+
+    Each record contains the slot address, the class and the vendor/device
+    IDs from the header line, the subsystem IDs and the kernel driver in use.
+    '''
+    devices = []
+    device = None
+    for line in lspci.split('\n'):
+        if not line:
+            continue
+
+        if not line.startswith('\t'):
+            device = None
+            header = LSPCI_HEADER.match(line)
+            if header is None:
+                continue
+            ids = DEVICE_IDS.search(header.group('description'))
+            if ids is None:
+                continue
+            device = _new_device('pci', header.group('address'), header.group('class'),
+                                 ids.group('vendor'), ids.group('device'), header.group('description'))
+            devices.append(device)
+        elif device is None:
+            continue
+        elif line.startswith('\tSubsystem:'):
+            ids = DEVICE_IDS.search(line)
+            if ids is not None:
+                device['subvendor'] = ids.group('vendor').lower()
+                device['subdevice'] = ids.group('device').lower()
+        elif line.startswith('\tKernel driver in use:'):
+            device['driver'] = line.split(':', 1)[1].strip()
+
+    return devices
+
+def parse_lsusb(lsusb):
+    '''Split the output of ``lsusb -v`` into one record per device.
+
+    The class is taken from the device descriptor, or from the first
+    interface if the device defines it per interface. lsusb does not
+    report the driver in use.
+    '''
+    devices = []
+    device = None
+    for line in lsusb.split('\n'):
+        if line.startswith('Bus '):
+            device = None
+            header = LSUSB_HEADER.match(line)
+            if header is None:
+                continue
+            address = header.group('bus') + ':' + header.group('dev')
+            device = _new_device('usb', address, '', header.group('vendor'),
+                                 header.group('device'), header.group('description'))
+            devices.append(device)
+            continue
+
+        if device is None:
+            continue
+
+        tmp = line.split()
+        if len(tmp) < 2 or tmp[0] not in ('bDeviceClass', 'bInterfaceClass'):
+            continue
+        if device['class'] and device['class'] != '00':
+            continue
+        try:
+            device['class'] = '{:02x}'.format(int(tmp[1]))
+        except ValueError:
+            pass
+
+    return devices
+
+def parse_iw_phy(iw_phy):
+    '''Summarize the bands of each PHY in the output of ``iw phy``.'''
+    phys = re.split('Wiphy (?P<phy>[^\s]*)\n', iw_phy)
+    phys = phys[1:]
+    wifi_phys = {}
+    while phys:
+        phy = phys[0]
+        values = phys[1]
+        phys = phys[2:]
+
+        wifi_phys[phy] = phy + ' Bands:'
+
+        bands = re.split('\tBand [0-9]+:\n', values, re.MULTILINE)[1:]
+        wifi_phys[phy] += '<ul>'
+
+        for band in bands:
+            wifi_phys[phy] += '<li>'
+            infos = []
+            if '\tHT20/HT40\n' in band:
+                infos.append('802.11n (40MHz)')
+            elif '\tHT20\n' in band:
+                infos.append('802.11n (20MHz)')
+            else:
+                infos.append('802.11g only')
+
+            streams = -1
+            streams_mcs = 'unresolved'
+            for match in re.finditer('(?P<streams>[1-8]) streams: (?P<mcs>MCS [0-9]+-[0-9]+)', band):
+                if int(match.group('streams')) > streams:
+                    streams = int(match.group('streams'))
+                    streams_mcs = match.group('mcs')
+
+            vht_capabilities = re.search('\tVHT Capabilities \((?P<vht_cap>0x[a-f0-9A-F]*)\)', band)
+            if vht_capabilities:
+                vht_capabilities = int(vht_capabilities.group('vht_cap'), 0)
+                bands = (vht_capabilities >> 2) & 3
+                if bands == 0:
+                    infos.append('802.11ac (80MHz, {:d} streams {})'.format(streams, streams_mcs))
+                elif bands == 1:
+                    infos.append('802.11ac (160MHz, {:d} streams {})'.format(streams, streams_mcs))
+                elif bands == 2:
+                    infos.append('802.11ac (160/80+80 MHz, {:d} streams {})'.format(streams, streams_mcs))
+                else:
+                    infos.append('802.11ac, {:d} streams {})'.format(streams, streams_mcs))
+            if infos:
+                wifi_phys[phy] += ', '.join(infos)
+            else:
+                wifi_phys[phy] += 'Unavailable'
+            wifi_phys[phy] += '</li>\n'
+        wifi_phys[phy] += '</ul>'
+    return wifi_phys
+
+def device_category(device):
+    if device['bus'] == 'pci':
+        return PCI_CLASS_CATEGORIES.get(device['class'], None)
+    return USB_CLASS_CATEGORIES.get(device['class'], None)
+
 class Test:
 
-    def __init__(self, fname):
-        self.zipfile = fname
-        self.zip = zipfile.ZipFile(self.zipfile, mode='r')
+    def __init__(self, fname, memo=None):
+        # Results of parsing sysinfo artifacts, see memoized()
+        self.memo = memo
+
+        # Either a filename or an already opened bundle
+        if hasattr(fname, 'namelist'):
+            self.zipfile = None
+            self.zip = fname
+        else:
+            self.zipfile = fname
+            self.zip = zipfile.ZipFile(self.zipfile, mode='r')
         self.zip.testzip()
 
         toplevel_dirs = set()
@@ -200,6 +467,7 @@ class Test:
 
     def get_sysinfo(self):
         include = {'Manufacturer', 'Product Name', 'Version', 'Family', 'SKU Number'}
+        include_bios = {'Version' : 'BIOS', 'Release Date' : 'BIOS Date'}
         dmidecode = self.read_sysinfo('dmidecode')
         hwinfo = 0
 
@@ -208,6 +476,8 @@ class Test:
                 hwinfo = 0
             if line == 'System Information':
                 hwinfo = 1
+            if line == 'BIOS Information':
+                hwinfo = 2
             if not hwinfo:
                 continue
             t = line.split(':', 1)
@@ -216,8 +486,10 @@ class Test:
             key, value = t
             key = key.strip()
             value = value.strip()
-            if key in include:
+            if hwinfo == 1 and key in include:
                 self.sysinfo[key] = value
+            elif hwinfo == 2 and key in include_bios:
+                self.sysinfo[include_bios[key]] = value
 
         cpuinfo = self.read_sysinfo('lscpu')
         match = re.search(r'^Model name:\s+(?P<model>.*)$', cpuinfo, re.MULTILINE)
@@ -265,58 +537,27 @@ class Test:
     def read_sysinfo(self, f, time='pre'):
         return self.zip.read(os.path.join(self.maindir, 'sysinfo', time, f)).decode('utf-8')
 
+    def memoized(self, kind, data, func):
+        '''Return func(data), looking it up in the memo by content hash.
+
+        The memo needs get(hash, kind) and put(hash, kind, result) methods,
+        results must be JSON serializable.
+        '''
+        if self.memo is None:
+            return func(data)
+
+        data_hash = artifact_hash(data)
+        kind = '{:s}:{:d}'.format(kind, CURRENT_VERSION)
+        res = self.memo.get(data_hash, kind)
+        if res is None:
+            res = func(data)
+            self.memo.put(data_hash, kind, res)
+        return res
+
 
     def resolve_wifi(self):
         # Just PHY capabilities for now?
-        iw_phy = self.read_sysinfo('iw_phy')
-        phys = re.split('Wiphy (?P<phy>[^\s]*)\n', iw_phy)
-        phys = phys[1:]
-        self.wifi_phys = {}
-        while phys:
-            phy = phys[0]
-            values = phys[1]
-            phys = phys[2:]
-
-            self.wifi_phys[phy] = phy + ' Bands:'
-
-            bands = re.split('\tBand [0-9]+:\n', values, re.MULTILINE)[1:]
-            self.wifi_phys[phy] += '<ul>'
-
-            for band in bands:
-                self.wifi_phys[phy] += '<li>'
-                infos = []
-                if '\tHT20/HT40\n' in band:
-                    infos.append('802.11n (40MHz)')
-                elif '\tHT20\n' in band:
-                    infos.append('802.11n (20MHz)')
-                else:
-                    infos.append('802.11g only')
-
-                streams = -1
-                streams_mcs = 'unresolved'
-                for match in re.finditer('(?P<streams>[1-8]) streams: (?P<mcs>MCS [0-9]+-[0-9]+)', band):
-                    if int(match.group('streams')) > streams:
-                        streams = int(match.group('streams'))
-                        streams_mcs = match.group('mcs')
-
-                vht_capabilities = re.search('\tVHT Capabilities \((?P<vht_cap>0x[a-f0-9A-F]*)\)', band)
-                if vht_capabilities:
-                    vht_capabilities = int(vht_capabilities.group('vht_cap'), 0)
-                    bands = (vht_capabilities >> 2) & 3
-                    if bands == 0:
-                        infos.append('802.11ac (80MHz, {:d} streams {})'.format(streams, streams_mcs))
-                    elif bands == 1:
-                        infos.append('802.11ac (160MHz, {:d} streams {})'.format(streams, streams_mcs))
-                    elif bands == 2:
-                        infos.append('802.11ac (160/80+80 MHz, {:d} streams {})'.format(streams, streams_mcs))
-                    else:
-                        infos.append('802.11ac, {:d} streams {})'.format(streams, streams_mcs))
-                if infos:
-                    self.wifi_phys[phy] += ', '.join(infos)
-                else:
-                    self.wifi_phys[phy] += 'Unavailable'
-                self.wifi_phys[phy] += '</li>\n'
-            self.wifi_phys[phy] += '</ul>'
+        self.wifi_phys = self.memoized('iw_phy', self.read_sysinfo('iw_phy'), parse_iw_phy)
 
 
     def resolve_hwtable(self):
@@ -331,10 +572,14 @@ class Test:
             self.hwtable['pointer'].resolved = ', '.join(ptrs)
 
         # TODO: Doesn't seem to detect USB-C (3.1)
-        lsusb = self.read_sysinfo('lsusb_-v')
+        self.usb_devices = self.memoized('lsusb', self.read_sysinfo('lsusb_-v'), parse_lsusb)
         hubs = set()
-        for match in re.finditer('Bus[^:]*: ID 1d6b:.* Linux Foundation (?P<version>.*) root hub', lsusb):
-            hubs.add(match.group('version'))
+        for dev in self.usb_devices:
+            if dev['vendor'] != '1d6b':
+                continue
+            match = re.match('Linux Foundation (?P<version>.*) root hub', dev['description'])
+            if match:
+                hubs.add(match.group('version'))
         if hubs:
             self.hwtable['usb'].text = ', '.join(sorted(hubs))
             self.hwtable['usb'].resolved = ', '.join(sorted(hubs))
@@ -342,11 +587,9 @@ class Test:
             # TODO: Warn here?
             pass
 
-        lspci = self.read_sysinfo('lspci_-vvnn')
+        self.pci_devices = self.memoized('lspci', self.read_sysinfo('lspci_-vvnn'), parse_lspci)
         wifi = ''
-        pci_wifis = []
-        for match in re.finditer(r'(?!\s)[^:]*\[0280\]:\s+(?P<device>.*)', lspci, re.MULTILINE):
-            pci_wifis.append(match.group('device'))
+        pci_wifis = [dev['description'] for dev in self.pci_devices if dev['class'] == '0280']
         if pci_wifis:
             wifi = '<br/>\n'.join(pci_wifis)
             wifi += '<br/>'
@@ -361,9 +604,7 @@ class Test:
 
         # Ethernet
         lan = ''
-        pci_lans = []
-        for match in re.finditer(r'(?!\s)[^:]*\[0200\]:\s+(?P<device>.*)', lspci, re.MULTILINE):
-            pci_lans.append(match.group('device'))
+        pci_lans = [dev['description'] for dev in self.pci_devices if dev['class'] == '0200']
         if pci_lans:
             self.hwtable['ethernet'].text = '\n'.join(pci_lans)
             self.hwtable['ethernet'].resolved = True
@@ -422,7 +663,7 @@ class Test:
                 self.hwtable['firmware'].resolved = True
 
             # Fingerprint
-            readers = self.find_dbus_objects('/net/reactivated/Fprint/Device/')
+            readers = self.find_dbus_interface('net.reactivated.Fprint.Device', '/net/reactivated/Fprint/Device/')
             if self._dbus is None:
                 self.hwtable['fingerprint'].text = 'Unresolved'
 
@@ -452,23 +693,18 @@ class Test:
             return
 
         try:
-            self._dbus = json.loads(self.zip.read(os.path.join(dbus_dump)).decode('utf-8'))
+            self._dbus = DBusIndex.load(self.zip.open(dbus_dump))
         except:
             print('Could not decode dbus dump. Maybe it failed being created?')
             pass
 
-    def find_dbus_objects(self, prefix):
+    def find_dbus_interface(self, interface, prefix=''):
         self.ensure_dbus()
 
         if not self._dbus:
             return []
 
-        res = {}
-        for s in self._dbus.values():
-            for obj_path, obj in s.iteritems():
-                if obj_path.startswith(prefix):
-                    res[obj_path] = obj
-        return res
+        return self._dbus.find_interface(interface, prefix)
 
     def parse_tests(self):
         for run in self.testruns:
@@ -498,6 +734,24 @@ class TestSummary:
 
     def __init__(self, test):
         self.test = test
+        self._artifacts = None
+
+    def gen_artifacts(self):
+        '''Return the sysinfo texts that are stored outside of the summary.
+
+        The summary only references them by their artifact_hash().
+        '''
+        if self._artifacts is None:
+            self._artifacts = {}
+            for name in ARTIFACTS:
+                try:
+                    self._artifacts[name] = self.test.read_sysinfo(name)
+                except KeyError:
+                    continue
+
+            self._artifacts['lspci'] = re.sub(r'^(\t.*|)\n', '', self.test.read_sysinfo('lspci_-vvnn'), flags=re.MULTILINE)
+            self._artifacts['lsusb'] = re.sub(r'^(?!Bus).*\n', '', self.test.read_sysinfo('lsusb_-v'), flags=re.MULTILINE)
+        return self._artifacts
 
     def gen_json(self):
         data = {}
@@ -514,8 +768,19 @@ class TestSummary:
                 'text' : value.text,
             }
 
-        data['lspci'] = re.sub(r'^(\t.*|)\n', '', self.test.read_sysinfo('lspci_-vvnn'), flags=re.MULTILINE)
-        data['lsusb'] = re.sub(r'^(?!Bus).*\n', '', self.test.read_sysinfo('lsusb_-v'), flags=re.MULTILINE)
+        data['artifacts'] = {}
+        for name, text in self.gen_artifacts().items():
+            data['artifacts'][name] = artifact_hash(text)
+
+        data['devices'] = []
+        for device in self.test.pci_devices + self.test.usb_devices:
+            device = dict(device)
+            device['category'] = device_category(device)
+            if device['category'] in self.test.hwtable:
+                device['status'] = self.test.hwtable[device['category']].status
+            else:
+                device['status'] = None
+            data['devices'].append(device)
 
         data['tests'] = []
         for testcase in self.test.testcases:
@@ -524,6 +789,66 @@ class TestSummary:
         return json.dumps(data)
 
 
+STYLE_RANK = {
+    'GOOD' : 0,
+    'INFO' : 0,
+    'WARN' : 1,
+    'BAD' : 2,
+}
+
+def diff_summaries(old, new):
+    '''Compare the summaries of two runs on the same machine.
+
+    Returns a list of changes in test results, hwtable entries and sysinfo.
+    A change is flagged as a regression if the new state is worse than the
+    old one.
+    '''
+    def change(kind, name, old_state, new_state, regression=False):
+        return {
+            'kind' : kind,
+            'name' : name,
+            'old' : old_state,
+            'new' : new_state,
+            'regression' : regression,
+        }
+
+    def worse(old_style, new_style):
+        return STYLE_RANK.get(new_style, 1) > STYLE_RANK.get(old_style, 0)
+
+    changes = []
+
+    old_tests = dict((t['name'], t) for t in old.get('tests', []))
+    new_tests = dict((t['name'], t) for t in new.get('tests', []))
+    for name in sorted(set(old_tests) | set(new_tests)):
+        o = old_tests.get(name, None)
+        n = new_tests.get(name, None)
+        o_status = o['status'] if o else None
+        n_status = n['status'] if n else None
+        if o_status == n_status:
+            continue
+        regression = n is not None and worse(o['style'] if o else None, n['style'])
+        changes.append(change('test', name, o_status, n_status, regression))
+
+    old_hw = old.get('hwtable', {})
+    new_hw = new.get('hwtable', {})
+    for field in sorted(set(old_hw) | set(new_hw)):
+        o_status = old_hw[field]['status'] if field in old_hw else None
+        n_status = new_hw[field]['status'] if field in new_hw else None
+        if o_status == n_status:
+            continue
+        name = new_hw[field]['type'] if field in new_hw else old_hw[field]['type']
+        regression = n_status is not None and worse(o_status, n_status)
+        changes.append(change('hwtable', name, o_status, n_status, regression))
+
+    old_sys = old.get('sysinfo', {})
+    new_sys = new.get('sysinfo', {})
+    for key in sorted(set(old_sys) | set(new_sys)):
+        if old_sys.get(key, None) != new_sys.get(key, None):
+            changes.append(change('sysinfo', key, old_sys.get(key, None), new_sys.get(key, None)))
+
+    return changes
+
+
 def is_uptodate(cache):
     if cache is None or not 'version' in cache:
         return False
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import sys
+
+COLUMNS = ['id', 'manufacturer', 'product', 'os', 'time', 'unique_identifier']
+
+# Parts of the cached summary that can be exported
+FIELDS = ['sysinfo', 'hwtable', 'tests']
+
+# sysinfo keys that get their own column in CSV output
+SYSINFO_COLUMNS = ['Manufacturer', 'Product Name', 'Version', 'Family', 'SKU Number',
+                   'CPU', 'Kernel', 'OS', 'BIOS', 'BIOS Date']
+
+
+class _Line:
+    '''File-like object that hands back what the csv writer writes.'''
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    # The Python 2 csv module only writes byte strings
+    if sys.version_info[0] < 3 and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def parse_fields(fields):
+    '''Parse a comma separated list of summary parts to export.
+
+    The machine columns are always exported, pass 'machine' to get nothing
+    else.
+    '''
+    if not fields:
+        return list(FIELDS)
+    res = [f.strip() for f in fields.split(',') if f.strip()]
+    for f in res:
+        if f not in FIELDS and f != 'machine':
+            raise ValueError('Unknown field {:s}, expected one of machine, {:s}'.format(f, ', '.join(FIELDS)))
+    return [f for f in FIELDS if f in res]
+
+
+def export_rows(db, fields, since=None, after=None, batch_size=500):
+    '''Iterate over all test runs, one dict per run.
+
+    Rows are fetched in batches of batch_size by ROWID, so no cursor (and
+    no database lock) is kept open while the caller handles a batch. The
+    cached summary is only decoded if one of its parts is exported.
+    '''
+    query = 'select ROWID as id, manufacturer, product, os, time, unique_identifier, cache from hwtestdb where ROWID > ?'
+    args = []
+    if since is not None:
+        query += ' and time > ?'
+        args.append(since)
+    query += ' ORDER BY ROWID LIMIT ?'
+
+    last = after if after is not None else 0
+    while True:
+        rows = db.execute(query, [last] + args + [batch_size]).fetchall()
+        for row in rows:
+            res = dict((c, row[c]) for c in COLUMNS)
+            if fields:
+                cache = json.loads(row['cache']) if row['cache'] else {}
+                if 'sysinfo' in fields:
+                    res['sysinfo'] = cache.get('sysinfo', {})
+                if 'hwtable' in fields:
+                    res['hwtable'] = dict((k, v['status']) for k, v in cache.get('hwtable', {}).items())
+                if 'tests' in fields:
+                    res['tests'] = dict((t['name'], t['status']) for t in cache.get('tests', []))
+            yield res
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]['id']
+
+
+def format_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, sort_keys=True) + '\n'
+
+
+def format_csv(rows, fields):
+    '''Format rows as CSV.
+
+    sysinfo is split into one column per known key, hwtable and test
+    statuses are stored as JSON objects in a single column each.
+    '''
+    header = list(COLUMNS)
+    if 'sysinfo' in fields:
+        header += ['sysinfo.' + k for k in SYSINFO_COLUMNS]
+    header += [f for f in fields if f != 'sysinfo']
+
+    writer = csv.writer(_Line())
+    yield writer.writerow([_cell(c) for c in header])
+
+    for row in rows:
+        line = [row[c] for c in COLUMNS]
+        if 'sysinfo' in fields:
+            line += [row['sysinfo'].get(k, '') for k in SYSINFO_COLUMNS]
+        line += [json.dumps(row[f], sort_keys=True) for f in fields if f != 'sysinfo']
+        yield writer.writerow([_cell(c) for c in line])
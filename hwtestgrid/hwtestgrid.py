@@ -9,10 +9,20 @@ import sys
 import random
 import zipfile
 import tempfile
+import tarfile
 import shutil
+import hashlib
+import multiprocessing
 from . import bundleparser
+from .pagecache import PageCache
+from .storage import BundleStore
+from . import export
+from .serve import Arbiter
+from .admission import Admission, SlotFile
+from .logview import LogCache
 
-from flask import Flask, render_template, request, send_file, redirect
+import click
+from flask import Flask, Response, jsonify, render_template, request, send_file, redirect
 
 app = Flask(__name__)
 app.config.from_object(__name__)
@@ -20,21 +30,53 @@ app.config.from_object(__name__)
 app.config.update({
     'DATABASE': os.environ.get("DATABASE", None) or
     os.path.join(app.root_path, 'hwtestgrid.db'),
+    'PAGE_CACHE_SIZE': int(os.environ.get("PAGE_CACHE_SIZE", None) or 128),
+    'PAGE_CACHE_DIR': os.environ.get("PAGE_CACHE_DIR", None),
+    # Bundles not modified for this many days are moved to cold storage
+    'BUNDLE_COLD_AGE': int(os.environ.get("BUNDLE_COLD_AGE", None) or 90),
+    # Members larger than this are stored as separate files in cold storage
+    'BUNDLE_SPLIT_SIZE': int(os.environ.get("BUNDLE_SPLIT_SIZE", None) or 1024 * 1024),
+    'SERVE_WORKERS': int(os.environ.get("SERVE_WORKERS", None) or multiprocessing.cpu_count()),
+    'SERVE_THREADS': int(os.environ.get("SERVE_THREADS", None) or 8),
+    # At most DOWNLOAD_SLOTS heavy downloads run at once per worker process
+    # (SERVE_WORKERS * DOWNLOAD_SLOTS in total), up to DOWNLOAD_QUEUE more
+    # wait DOWNLOAD_QUEUE_TIMEOUT seconds for a slot. Both together may only
+    # use half of SERVE_THREADS, the rest is kept for cheap requests.
+    # Single files smaller than DOWNLOAD_HEAVY_SIZE are never limited.
+    'DOWNLOAD_SLOTS': int(os.environ.get("DOWNLOAD_SLOTS", None) or 2),
+    'DOWNLOAD_QUEUE': int(os.environ.get("DOWNLOAD_QUEUE", None) or 2),
+    'DOWNLOAD_QUEUE_TIMEOUT': int(os.environ.get("DOWNLOAD_QUEUE_TIMEOUT", None) or 30),
+    'DOWNLOAD_HEAVY_SIZE': int(os.environ.get("DOWNLOAD_HEAVY_SIZE", None) or 16 * 1024 * 1024),
+    # Decompressed logs for the log viewer, with a checkpoint every
+    # LOG_INDEX_STEP lines
+    'LOG_CACHE_DIR': os.environ.get("LOG_CACHE_DIR", None),
+    'LOG_CACHE_SIZE': int(os.environ.get("LOG_CACHE_SIZE", None) or 2 * 1024 * 1024 * 1024),
+    'LOG_INDEX_STEP': int(os.environ.get("LOG_INDEX_STEP", None) or 1000),
+    'LOG_MAX_LINES': int(os.environ.get("LOG_MAX_LINES", None) or 10000),
+    # Lines searched by a single grep request, larger logs are searched in
+    # parts using start
+    'LOG_GREP_MAX_LINES': int(os.environ.get("LOG_GREP_MAX_LINES", None) or 100000),
+    # Processes per 'flask serve' worker parsing the bundles of batch
+    # uploads, and how long a batch may take to parse
+    'UPLOAD_PARSE_WORKERS': int(os.environ.get("UPLOAD_PARSE_WORKERS", None) or 2),
+    'UPLOAD_PARSE_TIMEOUT': int(os.environ.get("UPLOAD_PARSE_TIMEOUT", None) or 300),
 })
 
 def mysort(items, beginning=[], end=[]):
     items = list(sorted(items))
+    present = set(items)
+    special = set(beginning) | set(end)
 
     for item in beginning:
-        if item in items:
+        if item in present:
             yield item
 
     for item in items:
-        if not item in beginning and not item in end:
+        if not item in special:
             yield item
 
     for item in end:
-        if item in items:
+        if item in present:
             yield item
 
 app.jinja_env.filters['mysort'] = mysort
@@ -55,10 +97,17 @@ def state_to_style(state):
 app.jinja_env.filters['state_to_style'] = state_to_style
 
 
+# Databases that upgrade.sql has been run on by this process
+db_upgraded = set()
+
+
 def db_connect():
     db_path = app.config['DATABASE']
     rv = sqlite3.connect(db_path)
     rv.row_factory = sqlite3.Row
+    if db_path not in db_upgraded:
+        db_upgrade(rv)
+        db_upgraded.add(db_path)
     return rv
 
 
@@ -76,12 +125,23 @@ def db_close(error):
         g.the_database.close()
 
 
+def db_upgrade(db):
+    with app.open_resource('upgrade.sql', mode='r') as f:
+        db.cursor().executescript(f.read())
+    db.commit()
+
+
 def db_setup():
     db = db_get()
     with app.open_resource('schema.sql', mode='r') as f:
         db.cursor().executescript(f.read())
+    db_upgrade(db)
     db.commit()
 
+def bundle_store():
+    return BundleStore(os.path.join(app.root_path, 'data'))
+
+
 def get_tmpdir():
     try:
         return request.the_tmpdir
@@ -100,23 +160,151 @@ def clean_tmpdir(error):
 
 
 
-def test_get_cache(db, test_id):
+def page_cache_get():
+    if not hasattr(app, 'the_page_cache'):
+        app.the_page_cache = PageCache(app.config['PAGE_CACHE_SIZE'], app.config['PAGE_CACHE_DIR'])
+    return app.the_page_cache
+
+
+def template_hash(*names):
+    h = hashlib.sha1()
+    for name in names:
+        source = app.jinja_env.loader.get_source(app.jinja_env, name)[0]
+        h.update(source.encode('utf-8'))
+    return h.hexdigest()
+
+
+def page_cache_key(db, test_id, template):
+    '''Key a rendered test page by ROWID, summary version and template.
+
+    The summary itself is hashed too, so regenerating it (e.g. in another
+    worker process) never serves a stale page.
+    '''
+    if not hasattr(app, 'the_template_hashes'):
+        app.the_template_hashes = {}
+    if template not in app.the_template_hashes:
+        app.the_template_hashes[template] = template_hash(template, 'layout.html')
+
+    cur = db.execute('select cache from hwtestdb where ROWID = ?', [test_id])
+    cache = cur.fetchall()[0]['cache'] or ''
+    cache_hash = hashlib.sha1(cache.encode('utf-8')).hexdigest()
+
+    return (str(test_id), bundleparser.CURRENT_VERSION, cache_hash, app.the_template_hashes[template])
+
+
+def test_store_devices(db, test_id, summary):
+    db.execute('delete from devices where test_id = ?', [test_id])
+    db.executemany('insert into devices (test_id, bus, address, class, vendor, device, subvendor, subdevice, driver, description, category, status) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   [(test_id, d['bus'], d['address'], d['class'], d['vendor'], d['device'], d['subvendor'], d['subdevice'], d['driver'], d['description'], d['category'], d['status'])
+                    for d in summary.get('devices', [])])
+
+
+def test_store_changes(db, test_id, summary):
+    '''Diff a test run against the previous run of the same machine.'''
+    db.execute('delete from changes where test_id = ?', [test_id])
+
+    cur = db.execute('select manufacturer, product from hwtestdb where ROWID = ?', [test_id])
+    machine = cur.fetchall()[0]
+    cur = db.execute('select ROWID as rowid, cache from hwtestdb where manufacturer = ? and product = ? and ROWID < ? ORDER BY time DESC, ROWID DESC LIMIT 1',
+                     [machine['manufacturer'], machine['product'], test_id])
+    previous = cur.fetchall()
+    if not previous:
+        return
+
+    previous_id = previous[0]['rowid']
+    changes = bundleparser.diff_summaries(json.loads(previous[0]['cache']), summary)
+    db.executemany('insert into changes (test_id, previous_id, kind, name, old, new, regression) values (?, ?, ?, ?, ?, ?, ?)',
+                   [(test_id, previous_id, c['kind'], c['name'], c['old'], c['new'], c['regression'])
+                    for c in changes])
+
+
+class BlobMemo:
+    '''Memo for Test.memoized, backed by the blob_results table.
+
+    Every result is committed right away, so parsing never keeps a write
+    transaction open. db must not have uncommitted changes.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, blob_hash, kind):
+        cur = self.db.execute('select result from blob_results where hash = ? and kind = ?', [blob_hash, kind])
+        row = cur.fetchall()
+        if not row:
+            return None
+        return json.loads(row[0]['result'])
+
+    def put(self, blob_hash, kind, result):
+        # The memo is only an optimization, never fail because of it
+        try:
+            self.db.execute('insert or replace into blob_results (hash, kind, result) values (?, ?, ?)',
+                            [blob_hash, kind, json.dumps(result)])
+            self.db.commit()
+        except sqlite3.OperationalError:
+            self.db.rollback()
+
+
+def blobs_store(db, artifacts):
+    for text in artifacts.values():
+        blob_hash = bundleparser.artifact_hash(text)
+        db.execute('insert or ignore into blobs (hash, data, refcount) values (?, ?, 0)', [blob_hash, text])
+        db.execute('update blobs set refcount = refcount + 1 where hash = ?', [blob_hash])
+
+
+def blobs_release(db, hashes):
+    for blob_hash in hashes:
+        db.execute('update blobs set refcount = refcount - 1 where hash = ?', [blob_hash])
+    db.execute('delete from blob_results where hash in (select hash from blobs where refcount <= 0)')
+    db.execute('delete from blobs where refcount <= 0')
+
+
+def test_load_artifacts(db, data):
+    '''Replace the artifact hashes of a summary with their content.'''
+    artifacts = data.get('artifacts', {})
+    texts = {}
+    for name, blob_hash in artifacts.items():
+        cur = db.execute('select data from blobs where hash = ?', [blob_hash])
+        row = cur.fetchall()
+        texts[name] = row[0]['data'] if row else ''
+    data['artifacts'] = texts
+    return data
+
+
+def test_get_cache(db, test_id, force=False):
     cur = db.execute('select bundle, cache from hwtestdb where ROWID = ?', [test_id])
     row = cur.fetchall()
 
     bundle = row[0]['bundle']
     cache = json.loads(row[0]['cache'])
 
-    if bundleparser.is_uptodate(cache) and not app.debug:
+    if bundleparser.is_uptodate(cache) and not app.debug and not force:
         return cache
 
-    test = bundleparser.Test(os.path.join(app.root_path, 'data', 'bundles', bundle))
-    cache = bundleparser.TestSummary(test).gen_json()
+    test = bundleparser.Test(bundle_store().open(bundle), memo=BlobMemo(db))
+    summary = bundleparser.TestSummary(test)
+    cache = summary.gen_json()
+    data = json.loads(cache)
+
+    # Another request may have regenerated the summary while parsing. Re-read
+    # it under the write lock so old artifacts are released exactly once.
+    db.execute('BEGIN IMMEDIATE')
+    cur = db.execute('select cache from hwtestdb where ROWID = ?', [test_id])
+    current = json.loads(cur.fetchall()[0]['cache'])
+    if bundleparser.is_uptodate(current) and not app.debug and not force:
+        db.commit()
+        return current
+    old_artifacts = current.get('artifacts', {}).values() if current else []
 
     db.execute('UPDATE hwtestdb SET cache=? WHERE ROWID=?', (cache, test_id))
+    blobs_store(db, summary.gen_artifacts())
+    blobs_release(db, old_artifacts)
+    test_store_devices(db, test_id, data)
+    test_store_changes(db, test_id, data)
     db.commit()
+    page_cache_get().invalidate(str(test_id))
 
-    return json.loads(cache)
+    return data
 
 
 @app.cli.command('setupdb')
@@ -125,15 +313,183 @@ def initdb_command():
     db_setup()
 
 
+@app.cli.command('upgradedb')
+def upgradedb_command():
+    print('[DB] Upgrading [%s]' % app.config['DATABASE'])
+    db_upgrade(db_get())
+
+
+def prewarm():
+    '''Load everything a request may need, called in each worker after fork.'''
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    bundleparser.load_docstrings()
+    page_cache_get()
+
+    with app.app_context():
+        db = db_get()
+        db.execute('select count(*) from hwtestdb').fetchall()
+
+    # Fork the parser processes now, before the server starts its threads
+    if app.config['UPLOAD_PARSE_WORKERS'] > 1:
+        app.the_upload_pool = multiprocessing.Pool(app.config['UPLOAD_PARSE_WORKERS'])
+
+
+@app.cli.command('serve')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', type=int, default=5000)
+@click.option('--workers', type=int, default=None, help='Worker processes (default: SERVE_WORKERS)')
+@click.option('--threads', type=int, default=None, help='Threads per worker (default: SERVE_THREADS)')
+def serve_command(host, port, workers, threads):
+    workers = workers or app.config['SERVE_WORKERS']
+    threads = threads or app.config['SERVE_THREADS']
+    # Queued heavy downloads hold a thread too, keep half for cheap requests
+    heavy = app.config['DOWNLOAD_SLOTS'] + app.config['DOWNLOAD_QUEUE']
+    if heavy > threads // 2:
+        raise click.UsageError('DOWNLOAD_SLOTS + DOWNLOAD_QUEUE (%d) must be at most half the threads per worker (%d)' % (heavy, threads))
+    print('[Serve] At most %d heavy downloads at once (%d per worker)' % (workers * app.config['DOWNLOAD_SLOTS'], app.config['DOWNLOAD_SLOTS']))
+    Arbiter(app, host, port, workers, threads, prewarm=prewarm).run()
+
+
+@app.cli.command('reindex')
+def reindex_command():
+    '''Regenerate all summaries and the devices and changes tables.'''
+    db = db_get()
+    # Oldest first, so changes are computed against regenerated summaries
+    ids = [row[0] for row in db.execute('select ROWID from hwtestdb ORDER BY ROWID').fetchall()]
+    for test_id in ids:
+        try:
+            test_get_cache(db, test_id, force=True)
+        except Exception as e:
+            db.rollback()
+            print('[DB] Failed to reindex %d: %s' % (test_id, e))
+    print('[DB] Reindexed %d test runs' % len(ids))
+
+
+@app.cli.command('freezebundles')
+@click.option('--age', type=int, default=None, help='Minimum age in days (default: BUNDLE_COLD_AGE)')
+def freeze_bundles_command(age):
+    if age is None:
+        age = app.config['BUNDLE_COLD_AGE']
+    for bundle in bundle_store().freeze_old(age * 24 * 60 * 60, app.config['BUNDLE_SPLIT_SIZE']):
+        print('[Storage] Moved %s to cold storage' % bundle)
+
+
+def export_stream(fmt, fields, since, after):
+    # Uses its own connection as the response outlives the app context
+    db = db_connect()
+    try:
+        rows = export.export_rows(db, fields, since, after)
+        if fmt == 'csv':
+            for line in export.format_csv(rows, fields):
+                yield line
+        else:
+            for line in export.format_ndjson(rows):
+                yield line
+    finally:
+        db.close()
+
+
+@app.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--fields', default=None, help='Comma separated list of machine, sysinfo, hwtable, tests')
+@click.option('--since', default=None, help='Only export runs uploaded after this time')
+@click.option('--after', type=int, default=None, help='Only export runs with a larger ROWID')
+def export_command(fmt, fields, since, after):
+    try:
+        fields = export.parse_fields(fields)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    for line in export_stream(fmt, fields, since, after):
+        sys.stdout.write(line)
+
+
+@app.route('/export', methods=['GET'])
+def export_summaries():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return "Unknown format", 400
+    try:
+        fields = export.parse_fields(request.args.get('fields', None))
+        after = request.args.get('after', None)
+        if after is not None:
+            after = int(after)
+    except ValueError as e:
+        return str(e), 400
+    since = request.args.get('since', None)
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(export_stream(fmt, fields, since, after), mimetype=mimetype)
+
+
+def admission_get():
+    if not hasattr(app, 'the_admission'):
+        app.the_admission = Admission(app.config['DOWNLOAD_SLOTS'],
+                                      app.config['DOWNLOAD_QUEUE'],
+                                      app.config['DOWNLOAD_QUEUE_TIMEOUT'],
+                                      app.config['DOWNLOAD_HEAVY_SIZE'])
+    return app.the_admission
+
+
+# Deflating costs several times as much as inflating the same data
+RECOMPRESS_COST = 4
+
+
+def download_admit(cost):
+    '''Admit a download with the given uncompressed size.
+
+    Returns a tuple (slot, error). The slot is None for cheap downloads,
+    error is set to a 503 response if the download was rejected.
+    '''
+    admission = admission_get()
+    if not admission.is_heavy(cost):
+        return None, None
+
+    slot = admission.acquire()
+    if slot is None:
+        retry = str(app.config['DOWNLOAD_QUEUE_TIMEOUT'])
+        return None, ("Too many downloads in progress, try again later", 503, {'Retry-After': retry})
+    return slot, None
+
+
+def download_send(slot, f, **kwargs):
+    '''send_file() that releases the slot once the file has been sent.'''
+    if slot is None:
+        return send_file(f, **kwargs)
+
+    try:
+        return send_file(SlotFile(f, slot), **kwargs)
+    except:
+        slot.release()
+        raise
+
+
 @app.route('/download/<test_id>', methods=['GET'])
 def download_bundle(test_id):
     db = db_get()
     cur = db.execute('select bundle from hwtestdb where ROWID = ?', [test_id])
     bundle = cur.fetchall()[0]['bundle']
-    fname = os.path.join(app.root_path, 'data', 'bundles', bundle)
+    store = bundle_store()
+    fname = store.hot_path(bundle)
 
     if os.path.exists(fname):
-        return send_file(open(fname), attachment_filename=bundle, as_attachment=True)
+        return send_file(open(fname, 'rb'), attachment_filename=bundle, as_attachment=True)
+    elif store.exists(bundle):
+        # Cold bundles need to be reassembled
+        z = store.open(bundle)
+        slot, error = download_admit(sum(z.getinfo(f).file_size for f in z.namelist()) * RECOMPRESS_COST)
+        if error is not None:
+            z.close()
+            return error
+
+        try:
+            fname = os.path.join(get_tmpdir(), bundle)
+            z.write_zip(fname)
+            z.close()
+        except:
+            slot.release()
+            raise
+        return download_send(slot, open(fname, 'rb'), attachment_filename=bundle, as_attachment=True, add_etags=False)
     else:
         return "File does not exist", 404
 
@@ -142,14 +498,21 @@ def extract_file_bundle(test_id, path):
     db = db_get()
     cur = db.execute('select bundle from hwtestdb where ROWID = ?', [test_id])
     bundle = cur.fetchall()[0]['bundle']
-    fname = os.path.join(app.root_path, 'data', 'bundles', bundle)
-
-    if os.path.exists(fname):
-        z = zipfile.ZipFile(fname, 'r')
+    z = bundle_store().open(bundle)
 
+    if z is not None:
         if not path.endswith('/'):
             fname = os.path.basename(path)
-            f = z.open(path)
+            try:
+                size = z.getinfo(path).file_size
+                f = z.open(path)
+            except KeyError:
+                return "File does not exist", 404
+
+            slot, error = download_admit(size)
+            if error is not None:
+                f.close()
+                return error
 
             target_postfix = fname
             target_postfix = request.args.get('fname', target_postfix)
@@ -159,75 +522,325 @@ def extract_file_bundle(test_id, path):
             target = bundle[:-4] + '_' + target_postfix
             target = request.args.get('target', target)
 
-            return send_file(f, attachment_filename=target, as_attachment=not view, add_etags=False)
+            return download_send(slot, f, attachment_filename=target, as_attachment=not view, add_etags=False)
 
         else:
+            members = [f for f in z.namelist() if f.startswith(path)]
+            # The zip is stored uncompressed, so this costs about as much as
+            # extracting a single file of the same size
+            slot, error = download_admit(sum(z.getinfo(f).file_size for f in members))
+            if error is not None:
+                return error
+
             # Extract the directory and deliver a zip file with the content
-            resfile = os.path.join(get_tmpdir(), 'download.zip')
-            res = zipfile.ZipFile(resfile, 'w')
-            striplen = len(path) - 1
-            for f in z.namelist():
-                if not f.startswith(path):
-                    continue
-                res.writestr(f[striplen:], z.read(f))
-            res.close()
+            try:
+                resfile = os.path.join(get_tmpdir(), 'download.zip')
+                res = zipfile.ZipFile(resfile, 'w')
+                striplen = len(path) - 1
+                for f in members:
+                    res.writestr(f[striplen:], z.read(f))
+                res.close()
+            except:
+                slot.release()
+                raise
 
             target_postfix = path.replace('/', '_')
             target_postfix = request.args.get('fname', target_postfix)
             target = bundle[:-4] + '_' + target_postfix
             target = request.args.get('target', target)
 
-            return send_file(resfile, attachment_filename=target, as_attachment=True, add_etags=False)
+            return download_send(slot, open(resfile, 'rb'), attachment_filename=target, as_attachment=True, add_etags=False)
     else:
         return "File does not exist", 404
 
 
-@app.route('/upload', methods=['PUT'])
-def upload_bundle():
-    # Extract information from the bundle
-    tmpdir = get_tmpdir()
-    open(os.path.join(tmpdir, 'bundle_upload.zip'), 'w').write(request.data)
+def log_cache_get():
+    directory = app.config['LOG_CACHE_DIR'] or os.path.join(app.root_path, 'data', 'logcache')
+    return LogCache(directory, app.config['LOG_INDEX_STEP'], app.config['LOG_CACHE_SIZE'])
 
+
+@app.route('/log/<test_id>/<path:path>', methods=['GET'])
+def view_log(test_id, path):
+    '''Show part of a log inside a bundle.
+
+    Either count lines from line number start (counting from 0), the last
+    tail lines, or with grep set, up to count lines matching the regular
+    expression starting at line start. The total number of lines is
+    returned in the X-Log-Lines header.
+
+    grep searches at most LOG_GREP_MAX_LINES lines, the line to continue
+    the search at is returned in the X-Log-Grep-End header.
+    '''
     try:
-        test = bundleparser.Test(os.path.join(tmpdir, 'bundle_upload.zip'))
-        summary = bundleparser.TestSummary(test).gen_json()
-    except Exception as e:
-        shutil.copy(os.path.join(tmpdir, 'bundle_upload.zip'), '/tmp/broken-bundle-%s.zip' % datetime.datetime.now().isoformat())
-        return "Error parsing bundle ({:s})".format(str(e)), 500
+        start = int(request.args.get('start', 0))
+        count = min(int(request.args.get('count', 1000)), app.config['LOG_MAX_LINES'])
+        tail = request.args.get('tail', None)
+        tail = min(int(tail), app.config['LOG_MAX_LINES']) if tail is not None else None
+        grep = request.args.get('grep', None)
+        grep = re.compile(grep) if grep is not None else None
+    except (ValueError, re.error) as e:
+        return "Invalid argument ({:s})".format(str(e)), 400
+    if start < 0 or count < 0 or (tail is not None and tail < 0):
+        return "Invalid argument (negative line count)", 400
 
-    manufacturer = test.sysinfo['Manufacturer']
-    if 'Version' in test.sysinfo:
-        product = test.sysinfo['Version']
+    db = db_get()
+    cur = db.execute('select bundle from hwtestdb where ROWID = ?', [test_id])
+    bundle = cur.fetchall()[0]['bundle']
+
+    cache = log_cache_get()
+    index = cache.lookup((bundle, path))
+    if index is None:
+        z = bundle_store().open(bundle)
+        if z is None:
+            return "File does not exist", 404
+        try:
+            size = z.getinfo(path).file_size
+        except KeyError:
+            return "File does not exist", 404
+
+        # Decompressing and indexing a large log is as expensive as a download
+        slot, error = download_admit(size)
+        if error is not None:
+            return error
+        try:
+            index = cache.build((bundle, path), z.open(path))
+        finally:
+            if slot is not None:
+                slot.release()
+
+    grep_end = None
+    if grep is not None:
+        # A client supplied regex on a large log costs as much as a download
+        slot, error = download_admit(os.path.getsize(index.fname))
+        if error is not None:
+            return error
+        # Search eagerly, the output is bounded by count and the scan by
+        # LOG_GREP_MAX_LINES, and the end of the search is needed up front
+        try:
+            matches = list(index.grep(grep, start, count, app.config['LOG_GREP_MAX_LINES']))
+        finally:
+            if slot is not None:
+                slot.release()
+        if matches and len(matches) >= count:
+            grep_end = matches[-1][0] + 1
+        else:
+            grep_end = min(index.lines, start + app.config['LOG_GREP_MAX_LINES'])
+        lines = ['{:d}:'.format(lineno).encode('utf-8') + line for lineno, line in matches]
+    elif tail is not None:
+        lines = index.tail(tail)
     else:
-        product = test.sysinfo['Product Name']
+        lines = index.read_lines(start, count)
+
+    response = Response(lines, mimetype='text/plain')
+    response.headers['X-Log-Lines'] = str(index.lines)
+    if grep_end is not None:
+        response.headers['X-Log-Grep-End'] = str(grep_end)
+    return response
+
+
+def parse_bundle(fname):
+    '''Parse an uploaded bundle, returns a tuple (info, error).
+
+    This may run in a separate process for batch uploads, so only plain
+    data is returned.
+    '''
+    db = db_connect()
+    try:
+        test = bundleparser.Test(fname, memo=BlobMemo(db))
+        summary = bundleparser.TestSummary(test)
+        cache = summary.gen_json()
+
+        manufacturer = test.sysinfo['Manufacturer']
+        if 'Version' in test.sysinfo:
+            product = test.sysinfo['Version']
+        else:
+            product = test.sysinfo['Product Name']
+    except Exception as e:
+        shutil.copy(fname, '/tmp/broken-bundle-%s.zip' % datetime.datetime.now().isoformat())
+        return None, str(e)
+    finally:
+        db.close()
+
+    return {
+        'manufacturer' : manufacturer,
+        'product' : product,
+        'os' : test.sysinfo['OS'] if 'OS' in test.sysinfo else 'Unknown OS',
+        'unique_identifier' : test.get_unique_identifier(),
+        'summary' : cache,
+        'artifacts' : summary.gen_artifacts(),
+    }, None
+
+
+def insert_bundle(db, fname, info):
+    '''Move a parsed bundle into storage and insert it into the database.
+
+    Returns a tuple (ROWID, bundle) of the new test run. Raises
+    sqlite3.IntegrityError if the bundle has been uploaded before. On errors
+    the stored bundle is removed again, the caller needs to roll back the
+    database changes or commit them.
+    '''
+    bundle = datetime.date.today().isoformat() + '_' + info['manufacturer'] + '_' + info['product'] + '_{:06X}'.format(random.randrange(0, 0xFFFFFF)) + '.zip'
+    bundle_store().store(fname, bundle)
+
+    try:
+        cur = db.execute('insert into hwtestdb (manufacturer, product, os, unique_identifier, bundle, cache, time) values (?, ?, ?, ?, ?, ?, datetime(\'now\'))',
+                   [info['manufacturer'], info['product'], info['os'], info['unique_identifier'], bundle, info['summary']])
+
+        summary = json.loads(info['summary'])
+        blobs_store(db, info['artifacts'])
+        test_store_devices(db, cur.lastrowid, summary)
+        test_store_changes(db, cur.lastrowid, summary)
+    except Exception:
+        bundle_store().remove(bundle)
+        raise
+    return cur.lastrowid, bundle
+
+
+def receive_bundles(tmpdir):
+    '''Store all bundles of a multipart or tar request body in tmpdir.
+
+    Returns a list of (name, filename) tuples.
+    '''
+    bundles = []
+
+    def target():
+        return os.path.join(tmpdir, 'bundle_upload_{:d}.zip'.format(len(bundles)))
+
+    if request.files:
+        for key in request.files:
+            for f in request.files.getlist(key):
+                fname = target()
+                f.save(fname)
+                bundles.append((f.filename or key, fname))
+        return bundles
+
+    tar = tarfile.open(fileobj=request.stream, mode='r|*')
+    for member in tar:
+        if not member.isfile():
+            continue
+        fname = target()
+        with open(fname, 'wb') as dst:
+            shutil.copyfileobj(tar.extractfile(member), dst)
+        bundles.append((member.name, fname))
+    tar.close()
+    return bundles
 
-    os_name = test.sysinfo['OS'] if 'OS' in test.sysinfo else 'Unknown OS'
-    bundle = datetime.date.today().isoformat() + '_' + manufacturer + '_' + product + '_{:06X}'.format(random.randrange(0, 0xFFFFFF)) + '.zip'
-    shutil.move(os.path.join(tmpdir, 'bundle_upload.zip'), os.path.join(app.root_path, 'data', 'bundles', bundle))
+
+@app.route('/upload', methods=['PUT'])
+def upload_bundle():
+    # Extract information from the bundle
+    tmpdir = get_tmpdir()
+    fname = os.path.join(tmpdir, 'bundle_upload.zip')
+    open(fname, 'wb').write(request.data)
+
+    info, error = parse_bundle(fname)
+    if error is not None:
+        return "Error parsing bundle ({:s})".format(error), 500
 
     db = db_get()
     try:
-        db.execute('insert into hwtestdb (manufacturer, product, os, unique_identifier, bundle, cache, time) values (?, ?, ?, ?, ?, ?, datetime(\'now\'))',
-                   [manufacturer, product, os_name, test.get_unique_identifier(), bundle, summary])
+        insert_bundle(db, fname, info)
         db.commit()
     except sqlite3.IntegrityError:
-        os.unlink(os.path.join(app.root_path, 'data', 'bundles', bundle))
         return "Already exists", 409
     return "Created", 201
 
 
+@app.route('/upload/batch', methods=['PUT', 'POST'])
+def upload_batch():
+    '''Upload several bundles at once, as multipart form or tar stream.
+
+    Bundles are parsed by the worker's parser pool and inserted in a single
+    transaction. The response lists the status of each bundle, one of
+    created, duplicate or error.
+    '''
+    tmpdir = get_tmpdir()
+    try:
+        bundles = receive_bundles(tmpdir)
+    except tarfile.TarError as e:
+        return "Error reading tar stream ({:s})".format(str(e)), 400
+    if not bundles:
+        return "No bundles found", 400
+
+    files = [fname for name, fname in bundles]
+    # The pool only exists in 'flask serve' workers, see prewarm
+    pool = getattr(app, 'the_upload_pool', None)
+    if pool is not None and len(files) > 1:
+        try:
+            parsed = pool.map_async(parse_bundle, files).get(app.config['UPLOAD_PARSE_TIMEOUT'])
+        except multiprocessing.TimeoutError:
+            return "Parsing bundles timed out", 503
+    else:
+        parsed = [parse_bundle(fname) for fname in files]
+
+    db = db_get()
+    results = []
+    stored = []
+    # Manual transaction handling, each bundle gets a savepoint so a failing
+    # one does not take the others down with it
+    db.isolation_level = None
+    try:
+        db.execute('BEGIN')
+        for (name, fname), (info, error) in zip(bundles, parsed):
+            result = { 'name' : name }
+            if error is not None:
+                result['status'] = 'error'
+                result['error'] = 'Error parsing bundle ({:s})'.format(error)
+                results.append(result)
+                continue
+
+            db.execute('SAVEPOINT bundle')
+            try:
+                result['id'], bundle = insert_bundle(db, fname, info)
+                result['status'] = 'created'
+                stored.append(bundle)
+            except sqlite3.IntegrityError:
+                db.execute('ROLLBACK TO bundle')
+                result['status'] = 'duplicate'
+            except Exception as e:
+                db.execute('ROLLBACK TO bundle')
+                result['status'] = 'error'
+                result['error'] = 'Error storing bundle ({:s})'.format(str(e))
+            db.execute('RELEASE bundle')
+            results.append(result)
+        db.execute('COMMIT')
+    except Exception:
+        try:
+            db.execute('ROLLBACK')
+        except sqlite3.OperationalError:
+            # No transaction left to roll back
+            pass
+        for bundle in stored:
+            bundle_store().remove(bundle)
+        raise
+    finally:
+        db.isolation_level = ''
+
+    return jsonify(bundles=results), 200
+
 
 @app.route('/testrun/<test_id>', methods=['GET'])
 def show_single(test_id):
     db = db_get()
 
-    data = test_get_cache(db, test_id)
+    if app.debug:
+        page = None
+    else:
+        page = page_cache_get().get(page_cache_key(db, test_id, 'test.html'))
+
+    if page is None:
+        data = test_load_artifacts(db, test_get_cache(db, test_id))
+
+        data['rowid'] = test_id
 
-    data['rowid'] = test_id
+        page = render_template('test.html',
+                               title="Testsummary",
+                               data=data)
 
-    return render_template('test.html',
-                           title="Testsummary",
-                           data=data)
+        if not app.debug:
+            page_cache_get().put(page_cache_key(db, test_id, 'test.html'), page)
+
+    return page
 
 @app.route('/list')
 def lst():
@@ -240,12 +853,41 @@ def lst():
                            title="Machine List",
                            entries=data)
 
+@app.route('/device/<vendor>:<device>')
+def show_device(vendor, device):
+    db = db_get()
+    query = ("select hwtestdb.rowid as test_id, hwtestdb.manufacturer, hwtestdb.product, hwtestdb.os, hwtestdb.time, devices.* "
+             "from devices join hwtestdb on hwtestdb.rowid = devices.test_id "
+             "where devices.vendor = ? and devices.device = ? "
+             "ORDER BY hwtestdb.manufacturer, hwtestdb.product, hwtestdb.os, hwtestdb.time DESC")
+    cur = db.execute(query, [vendor.lower(), device.lower()])
+    data = cur.fetchall()
+
+    return render_template('device.html',
+                           title="Device {:s}:{:s}".format(vendor, device),
+                           entries=data)
+
+@app.route('/regressions')
+def show_regressions():
+    db = db_get()
+    query = ("select hwtestdb.rowid as test_id, hwtestdb.manufacturer, hwtestdb.product, hwtestdb.os, hwtestdb.time, changes.* "
+             "from changes join hwtestdb on hwtestdb.rowid = changes.test_id "
+             "where changes.regression "
+             "ORDER BY hwtestdb.time DESC, hwtestdb.rowid DESC, changes.kind, changes.name")
+    cur = db.execute(query)
+    data = cur.fetchall()
+
+    return render_template('regressions.html',
+                           title="Regressions",
+                           entries=data)
+
 @app.route("/robots.txt")
 def robots_txt():
     '''Disallow the /download URL as downloads may be large and CPU intensive'''
     disallow = lambda string: 'Disallow: {0}'.format(string)
     return "User-agent: *\n{0}\n".format("\n".join([
         disallow('/download'),
+        disallow('/log'),
     ])), 200
 
 
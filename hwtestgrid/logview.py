@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# grep only matches the beginning of very long lines
+GREP_LINE_LENGTH = 4096
+
+
+class LogIndex:
+    '''Line index of a decompressed log file.
+
+    The offset of every step'th line is recorded, so reading any line only
+    requires reading at most step lines from the closest checkpoint.
+    '''
+
+    def __init__(self, fname, step, lines, offsets):
+        self.fname = fname
+        self.step = step
+        self.lines = lines
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, src, fname, step):
+        '''Copy the file object src to fname while indexing its lines.'''
+        offsets = [0]
+        lines = 0
+        base = 0
+        last = b''
+        with open(fname, 'wb') as dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+
+                pos = 0
+                while True:
+                    need = len(offsets) * step - lines
+                    available = chunk.count(b'\n', pos)
+                    if available < need:
+                        lines += available
+                        break
+                    for i in range(need):
+                        pos = chunk.find(b'\n', pos) + 1
+                    lines += need
+                    offsets.append(base + pos)
+
+                base += len(chunk)
+                last = chunk[-1:]
+
+        # Count a last line without trailing newline
+        if last and last != b'\n':
+            lines += 1
+
+        return cls(fname, step, lines, offsets)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname + '.idx', 'r') as f:
+            data = json.load(f)
+        return cls(fname, data['step'], data['lines'], data['offsets'])
+
+    def save(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({'step' : self.step, 'lines' : self.lines, 'offsets' : self.offsets}, f)
+
+    def _seek(self, f, start):
+        if start < 0:
+            raise ValueError('Negative line number {:d}'.format(start))
+        checkpoint = min(start // self.step, len(self.offsets) - 1)
+        f.seek(self.offsets[checkpoint])
+        for i in range(start - checkpoint * self.step):
+            if not f.readline():
+                break
+
+    def read_lines(self, start, count):
+        '''Iterate over count lines, starting with line number start.'''
+        with open(self.fname, 'rb') as f:
+            self._seek(f, start)
+            for i in range(count):
+                line = f.readline()
+                if not line:
+                    break
+                yield line
+
+    def tail(self, count):
+        return self.read_lines(max(0, self.lines - count), count)
+
+    def grep(self, regex, start=0, limit=None, max_lines=None):
+        '''Iterate over (line number, line) of matching lines.
+
+        At most max_lines lines are searched, and only their first
+        GREP_LINE_LENGTH bytes.
+        '''
+        end = self.lines if max_lines is None else min(self.lines, start + max_lines)
+        matches = 0
+        with open(self.fname, 'rb') as f:
+            self._seek(f, start)
+            for lineno in range(start, end):
+                line = f.readline()
+                if not line:
+                    return
+                if regex.search(line[:GREP_LINE_LENGTH].decode('utf-8', 'replace')):
+                    yield lineno, line
+                    matches += 1
+                    if limit is not None and matches >= limit:
+                        return
+
+
+class LogCache:
+    '''Directory of decompressed logs with their line index.
+
+    Logs are decompressed and indexed on first access. The least recently
+    used logs are removed once the directory grows beyond max_size bytes.
+    '''
+
+    def __init__(self, directory, step, max_size):
+        self.directory = directory
+        self.step = step
+        self.max_size = max_size
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.log')
+
+    def lookup(self, key):
+        '''Return the index of a cached log, or None.'''
+        fname = self._filename(key)
+        try:
+            index = LogIndex.load(fname)
+            os.utime(fname + '.idx', None)
+        except (IOError, OSError, ValueError):
+            return None
+        return index
+
+    def build(self, key, src):
+        '''Decompress and index the file object src.'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fname = self._filename(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            index = LogIndex.build(src, tmp, self.step)
+            index.save(tmp + '.idx')
+            os.rename(tmp, fname)
+            os.rename(tmp + '.idx', fname + '.idx')
+        finally:
+            for f in (tmp, tmp + '.idx'):
+                if os.path.exists(f):
+                    os.unlink(f)
+        index.fname = fname
+
+        self.expire(keep=fname)
+        return index
+
+    def expire(self, keep=None):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            fname = os.path.join(self.directory, name)
+            if not name.endswith('.log') or fname == keep:
+                continue
+            try:
+                size = os.path.getsize(fname)
+                used = os.path.getmtime(fname + '.idx')
+            except OSError:
+                continue
+            entries.append((used, fname))
+            total += size
+        if keep is not None and os.path.exists(keep):
+            total += os.path.getsize(keep)
+
+        for used, fname in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                total -= os.path.getsize(fname)
+                # Remove the index first so the log is not used meanwhile
+                os.unlink(fname + '.idx')
+                os.unlink(fname)
+            except OSError:
+                pass
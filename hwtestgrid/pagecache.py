@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class PageCache:
+    '''LRU cache for rendered pages, optionally backed by a directory.
+
+    Keys are tuples whose first element is the test ROWID; this allows
+    dropping every entry of a test run when its summary is regenerated.
+    Pages evicted from memory remain available on disk if a directory is
+    configured.
+    '''
+
+    def __init__(self, size=128, directory=None):
+        self.size = size
+        self.directory = directory
+        self._pages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, '{}-{}.html'.format(key[0], digest))
+
+    def get(self, key):
+        with self._lock:
+            try:
+                page = self._pages.pop(key)
+                self._pages[key] = page
+                return page
+            except KeyError:
+                pass
+
+        if not self.directory:
+            return None
+
+        try:
+            with open(self._filename(key), 'rb') as f:
+                page = f.read().decode('utf-8')
+        except IOError:
+            return None
+
+        self._remember(key, page)
+        return page
+
+    def put(self, key, page):
+        self._remember(key, page)
+
+        if not self.directory:
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(page.encode('utf-8'))
+        os.rename(tmp, self._filename(key))
+
+    def _remember(self, key, page):
+        if self.size <= 0:
+            return
+
+        with self._lock:
+            self._pages.pop(key, None)
+            self._pages[key] = page
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, rowid):
+        with self._lock:
+            for key in [k for k in self._pages if k[0] == rowid]:
+                del self._pages[key]
+
+        if not self.directory:
+            return
+
+        for fname in glob.glob(os.path.join(self.directory, '{}-*.html'.format(rowid))):
+            try:
+                os.unlink(fname)
+            except OSError:
+                pass
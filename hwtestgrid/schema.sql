@@ -1,17 +1,6 @@
+-- Removes all data, the tables are then created by upgrade.sql
 drop table if exists hwtestdb;
-create table hwtestdb (
-  machine TEXT,
-
-  -- NOTE: The selection of what to cache here will need to change in the future
-  'manufacturer' TEXT,
-  'product' TEXT, 
-  'os' TEXT,
-  'time' DATETIME,
-
-  'unique_identifier' TEXT UNIQUE,
-
-  'bundle' TEXT,
-  'cache' JSON
-);
-
-
+drop table if exists devices;
+drop table if exists changes;
+drop table if exists blobs;
+drop table if exists blob_results;
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    '''WSGI server handling up to a fixed number of requests in parallel.
+
+    Each request is handled in its own thread, accepting new connections
+    blocks while all slots are busy.
+    '''
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        BaseWSGIServer.__init__(self, host, port, app, fd=fd)
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        t = threading.Thread(target=self._handle_request, args=(request, client_address))
+        t.daemon = True
+        t.start()
+
+    def _handle_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def wait(self, timeout):
+        '''Wait for running requests to finish, at most timeout seconds.'''
+        deadline = time.time() + timeout
+        acquired = 0
+        while acquired < self.threads and time.time() < deadline:
+            if self._slots.acquire(False):
+                acquired += 1
+            else:
+                time.sleep(0.1)
+        return acquired == self.threads
+
+
+# Passed to the re-executed master on reload
+LISTEN_FD_ENV = 'HWTESTGRID_LISTEN_FD'
+OLD_WORKERS_ENV = 'HWTESTGRID_OLD_WORKERS'
+
+
+class Arbiter:
+    '''Pre-forking master process.
+
+    The listening socket is opened once and shared by all workers. Each
+    worker calls the prewarm function after the fork and then serves
+    requests with a PooledWSGIServer. SIGTERM and SIGINT stop the server.
+
+    SIGHUP re-executes the master with the same command line, so new code
+    and configuration are loaded. The listening socket is handed over, the
+    new master starts its workers and then gracefully stops the old ones.
+
+    Workers that exit within min_uptime seconds of being started are
+    restarted with an exponential backoff of up to max_backoff seconds.
+    '''
+
+    def __init__(self, app, host, port, workers, threads, prewarm=None, timeout=30,
+                 min_uptime=10, max_backoff=30):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.threads = threads
+        self.prewarm = prewarm
+        self.timeout = timeout
+        self.min_uptime = min_uptime
+        self.max_backoff = max_backoff
+
+        self.workers = set()
+        self.started = {}
+        self.failures = 0
+        self.respawns = []
+        self._reload = False
+        self._stop = False
+
+    def log(self, message, *args):
+        sys.stderr.write('[%d] %s\n' % (os.getpid(), message % args))
+
+    def listen(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is not None:
+            # Inherited from the previous master, see reexec
+            self.sock = socket.fromfd(int(fd), family, socket.SOCK_STREAM)
+            os.close(int(fd))
+            return
+
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(PooledWSGIServer.request_queue_size)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            self.started[pid] = time.time()
+            return
+
+        try:
+            self.run_worker()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def run_worker(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        if self.prewarm is not None:
+            self.prewarm()
+
+        server = PooledWSGIServer(self.host, self.port, self.app, self.threads, fd=self.sock.fileno())
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever returns
+            threading.Thread(target=server.shutdown).start()
+        signal.signal(signal.SIGTERM, stop)
+
+        self.log('Worker ready')
+        server.serve_forever()
+        if not server.wait(self.timeout):
+            self.log('Worker stopped with requests still running')
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if not pid:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                started = self.started.pop(pid)
+                if self._stop:
+                    continue
+
+                if time.time() - started < self.min_uptime:
+                    self.failures += 1
+                else:
+                    self.failures = 0
+                delay = min(2 ** self.failures - 1, self.max_backoff)
+                self.log('Worker %d exited (status %d), restarting in %d seconds', pid, status, delay)
+                self.respawns.append(time.time() + delay)
+
+    def respawn(self):
+        now = time.time()
+        for due in list(self.respawns):
+            if due <= now:
+                self.respawns.remove(due)
+                self.spawn()
+
+    def kill_workers(self, workers, sig=signal.SIGTERM):
+        for pid in workers:
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    def reexec(self):
+        '''Replace the master process by running its command line again.'''
+        fd = self.sock.fileno()
+        if hasattr(os, 'set_inheritable'):
+            os.set_inheritable(fd, True)
+        env = dict(os.environ)
+        env[LISTEN_FD_ENV] = str(fd)
+        env[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.workers)
+
+        args = list(sys.argv)
+        if os.path.basename(args[0]) == '__main__.py':
+            # Started with python -m
+            args = ['-m', os.path.basename(os.path.dirname(args[0]))] + args[1:]
+
+        self.log('Reloading')
+        try:
+            os.execve(sys.executable, [sys.executable] + args, env)
+        except OSError as e:
+            self.log('Reload failed: %s', e)
+
+    def run(self):
+        self.listen()
+        self.log('Listening on http://%s:%d/ with %d workers, %d threads each',
+                 self.host, self.port, self.num_workers, self.threads)
+        old = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+
+        def reload(signum, frame):
+            self._reload = True
+        def stop(signum, frame):
+            self._stop = True
+        signal.signal(signal.SIGHUP, reload)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for i in range(self.num_workers):
+            self.spawn()
+        if old:
+            self.log('Stopping workers of the previous master')
+            self.kill_workers(old)
+
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                self.reexec()
+
+            self.reap()
+            self.respawn()
+            time.sleep(0.5)
+
+        self.log('Stopping workers')
+        self.kill_workers(self.workers)
+        deadline = time.time() + self.timeout
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.kill_workers(self.workers, signal.SIGKILL)
+        self.sock.close()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import bz2
+import json
+import os
+import shutil
+import time
+import zipfile
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# Prefer LZMA when recompressing, older Pythons only have deflate and bzip2
+COLD_COMPRESSION = getattr(zipfile, 'ZIP_LZMA', zipfile.ZIP_DEFLATED)
+COLD_ZIP_CODEC = 'lzma' if COLD_COMPRESSION != zipfile.ZIP_DEFLATED else 'deflate'
+COLD_SUFFIX = '.xz' if lzma is not None else '.bz2'
+
+
+def _open_compressed(path, codec):
+    if codec == 'xz':
+        if lzma is None:
+            raise IOError('{:s} is compressed with xz, which needs the lzma module'.format(path))
+        return lzma.open(path, 'rb')
+    return bz2.BZ2File(path, 'rb')
+
+
+class ColdMemberInfo:
+    def __init__(self, name, size):
+        self.filename = name
+        self.file_size = size
+
+
+class ColdBundle:
+    '''Read access to a bundle in cold storage.
+
+    A cold bundle is a directory containing a recompressed zip with the
+    small members, one compressed file per large member and an index of all
+    members. It implements the subset of the ZipFile API that the parser and
+    the download views use.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'index.json'), 'r') as f:
+            index = json.load(f)
+
+        self._members = [m['name'] for m in index['members']]
+        self._info = dict((m['name'], m) for m in index['members'])
+        # Missing in bundles frozen before the codecs were recorded
+        self._compression = index.get('compression', None)
+        self._zip = None
+
+    @property
+    def zip(self):
+        if self._zip is None:
+            if self._compression == 'lzma' and not hasattr(zipfile, 'ZIP_LZMA'):
+                raise IOError('{:s} is compressed with LZMA, which needs Python 3'.format(self.directory))
+            self._zip = zipfile.ZipFile(os.path.join(self.directory, 'bundle.zip'), 'r')
+        return self._zip
+
+    def namelist(self):
+        return list(self._members)
+
+    def getinfo(self, name):
+        return ColdMemberInfo(name, self._info[name]['size'])
+
+    def testzip(self):
+        return self.zip.testzip()
+
+    def open(self, name):
+        member = self._info[name]
+        if member['file'] is None:
+            return self.zip.open(name)
+
+        codec = member.get('codec', None) or os.path.splitext(member['file'])[1][1:]
+        return _open_compressed(os.path.join(self.directory, member['file']), codec)
+
+    def read(self, name):
+        f = self.open(name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def write_zip(self, target):
+        '''Reassemble the original bundle as a zip file.'''
+        res = zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED)
+        for name in self._members:
+            res.writestr(name, self.read(name))
+        res.close()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+class BundleStore:
+    '''Bundle storage split into a hot and a cold tier.
+
+    New bundles are stored as uploaded in the hot tier. Bundles that have
+    not been modified for a while can be moved to the cold tier, see
+    :meth:`freeze`.
+    '''
+
+    def __init__(self, root):
+        self.hot = os.path.join(root, 'bundles')
+        self.cold = os.path.join(root, 'cold')
+
+    def hot_path(self, bundle):
+        return os.path.join(self.hot, bundle)
+
+    def cold_path(self, bundle):
+        return os.path.join(self.cold, bundle[:-4] if bundle.endswith('.zip') else bundle)
+
+    def exists(self, bundle):
+        return os.path.exists(self.hot_path(bundle)) or os.path.isdir(self.cold_path(bundle))
+
+    def open(self, bundle):
+        '''Open a bundle from either tier, returns None if it does not exist.'''
+        if os.path.exists(self.hot_path(bundle)):
+            return zipfile.ZipFile(self.hot_path(bundle), 'r')
+        if os.path.isdir(self.cold_path(bundle)):
+            return ColdBundle(self.cold_path(bundle))
+        return None
+
+    def store(self, fname, bundle):
+        shutil.move(fname, self.hot_path(bundle))
+
+    def remove(self, bundle):
+        if os.path.exists(self.hot_path(bundle)):
+            os.unlink(self.hot_path(bundle))
+        if os.path.isdir(self.cold_path(bundle)):
+            shutil.rmtree(self.cold_path(bundle))
+
+    def freeze(self, bundle, split_size):
+        '''Move a single bundle from the hot to the cold tier.
+
+        Members larger than split_size bytes are compressed into separate
+        files so that reading them does not require the zip to be opened.
+        '''
+        target = self.cold_path(bundle)
+        if os.path.isdir(target):
+            # An earlier run stopped between renaming and removing the hot
+            # copy, the cold copy is complete as it is renamed last
+            os.unlink(self.hot_path(bundle))
+            return
+
+        tmp = os.path.join(self.cold, '.' + os.path.basename(target) + '.tmp')
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        z = zipfile.ZipFile(self.hot_path(bundle), 'r')
+        res = zipfile.ZipFile(os.path.join(tmp, 'bundle.zip'), 'w', COLD_COMPRESSION)
+        members = []
+        for info in z.infolist():
+            member = {
+                'name' : info.filename,
+                'size' : info.file_size,
+                'file' : None,
+                'codec' : None,
+            }
+            if info.file_size > split_size:
+                member['file'] = '{:04d}{:s}'.format(len(members), COLD_SUFFIX)
+                member['codec'] = COLD_SUFFIX[1:]
+                src = z.open(info.filename)
+                if lzma is not None:
+                    dst = lzma.open(os.path.join(tmp, member['file']), 'wb')
+                else:
+                    dst = bz2.BZ2File(os.path.join(tmp, member['file']), 'wb')
+                shutil.copyfileobj(src, dst)
+                dst.close()
+            else:
+                zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+                zinfo.compress_type = COLD_COMPRESSION
+                res.writestr(zinfo, z.read(info.filename))
+            members.append(member)
+        res.close()
+        z.close()
+
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump({'bundle' : bundle, 'compression' : COLD_ZIP_CODEC, 'members' : members}, f)
+
+        os.rename(tmp, target)
+        os.unlink(self.hot_path(bundle))
+
+    def freeze_old(self, max_age, split_size):
+        '''Move all hot bundles older than max_age seconds to the cold tier.'''
+        if not os.path.isdir(self.cold):
+            os.makedirs(self.cold)
+
+        frozen = []
+        now = time.time()
+        for bundle in sorted(os.listdir(self.hot)):
+            if not bundle.endswith('.zip'):
+                continue
+            if now - os.path.getmtime(self.hot_path(bundle)) < max_age:
+                continue
+            self.freeze(bundle, split_size)
+            frozen.append(bundle)
+        return frozen
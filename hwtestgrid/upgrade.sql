@@ -0,0 +1,69 @@
+-- Creates all tables that do not exist yet, this is run on every start so
+-- that existing databases pick up new tables. Never drop anything here.
+create table if not exists hwtestdb (
+  machine TEXT,
+
+  -- NOTE: The selection of what to cache here will need to change in the future
+  'manufacturer' TEXT,
+  'product' TEXT, 
+  'os' TEXT,
+  'time' DATETIME,
+
+  'unique_identifier' TEXT UNIQUE,
+
+  'bundle' TEXT,
+  'cache' JSON
+);
+create index if not exists hwtestdb_machine on hwtestdb (manufacturer, product);
+create index if not exists hwtestdb_time on hwtestdb (time);
+
+create table if not exists devices (
+  -- ROWID of the test run in hwtestdb
+  'test_id' INTEGER,
+
+  'bus' TEXT,
+  'address' TEXT,
+  'class' TEXT,
+  'vendor' TEXT,
+  'device' TEXT,
+  'subvendor' TEXT,
+  'subdevice' TEXT,
+  'driver' TEXT,
+  'description' TEXT,
+
+  -- hwtable entry the device belongs to and its status for the test run
+  'category' TEXT,
+  'status' TEXT
+);
+create index if not exists devices_ids on devices (vendor, device);
+create index if not exists devices_test on devices (test_id);
+
+create table if not exists changes (
+  -- ROWID of the test run in hwtestdb and of the run it was compared to
+  'test_id' INTEGER,
+  'previous_id' INTEGER,
+
+  -- One of 'test', 'hwtable' or 'sysinfo'
+  'kind' TEXT,
+  'name' TEXT,
+  'old' TEXT,
+  'new' TEXT,
+  'regression' BOOLEAN
+);
+create index if not exists changes_test on changes (test_id);
+create index if not exists changes_regression on changes (regression);
+
+create table if not exists blobs (
+  -- sysinfo artifacts shared by test runs, keyed by content hash
+  'hash' TEXT PRIMARY KEY,
+  'data' TEXT,
+  'refcount' INTEGER
+);
+
+create table if not exists blob_results (
+  -- Memoized parse results of a blob, see Test.memoized
+  'hash' TEXT,
+  'kind' TEXT,
+  'result' JSON,
+  PRIMARY KEY ('hash', 'kind')
+);
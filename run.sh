@@ -12,7 +12,9 @@ echo "DB is at: $DATABASE"
 if [ ! -f "$DATABASE" ]; then
   echo "Initializing $DATABASE"
   python2 -m flask setupdb
+else
+  python2 -m flask upgradedb
 fi
 
-exec python2 -m flask run --host 0.0.0.0
+exec python2 -m flask serve --host 0.0.0.0
 
@@ -7,6 +7,12 @@ setup(name='hwtestgrid',
       install_requires=[
           'flask',
       ],
+      extras_require={
+          # Decode large D-Bus dumps incrementally, ijson 3 dropped
+          # Python 2 and kvitems needs at least 2.5
+          'ijson': ['ijson>=2.5,<3; python_version<"3"',
+                    'ijson>=2.5; python_version>="3"'],
+      },
       setup_requires=[
           'pytest-runner',
       ],
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+
+from hwtestgrid import bundleparser
+
+lspci = '''00:02.0 VGA compatible controller [0300]: Intel Corporation HD Graphics 620 [8086:5916] (rev 02) (prog-if 00 [VGA controller])
+\tSubsystem: Lenovo Device [17aa:224f]
+\tControl: I/O+ Mem+ BusMaster+ SpecCycle- MemWINV- VGASnoop- ParErr- Stepping- SERR- FastB2B- DisINTx+
+\tLatency: 0
+\tKernel driver in use: i915
+\tKernel modules: i915
+
+00:14.0 USB controller [0c03]: Intel Corporation Sunrise Point-LP USB 3.0 xHCI Controller [8086:9d2f] (rev 21) (prog-if 30 [XHCI])
+\tSubsystem: Lenovo Device [17aa:224f]
+\tKernel driver in use: xhci_hcd
+
+00:1f.3 Audio device [0403]: Intel Corporation Sunrise Point-LP HD Audio [8086:9d71] (rev 21)
+\tKernel modules: snd_hda_intel
+
+04:00.0 Network controller [0280]: Intel Corporation Wireless 8265 / 8275 [8086:24FD] (rev 88)
+\tSubsystem: Intel Corporation Device [8086:0130]
+\tKernel driver in use: iwlwifi
+'''
+
+lsusb = '''
+Bus 001 Device 003: ID 8087:0a2b Intel Corp.
+Device Descriptor:
+  bLength                18
+  bDescriptorType         1
+  bcdUSB               2.00
+  bDeviceClass          224 Wireless
+  bDeviceSubClass         1 Radio Frequency
+  bDeviceProtocol         1 Bluetooth
+
+Bus 001 Device 002: ID 04f2:b5ce Chicony Electronics Co., Ltd Integrated Camera
+Device Descriptor:
+  bDeviceClass          239 Miscellaneous Device
+  bDeviceSubClass         2 ?
+  Configuration Descriptor:
+    Interface Descriptor:
+      bInterfaceClass        14 Video
+
+Bus 002 Device 004: ID 0781:5581 SanDisk Corp. Ultra
+Device Descriptor:
+  bDeviceClass            0 (Defined at Interface level)
+  Configuration Descriptor:
+    Interface Descriptor:
+      bInterfaceClass         8 Mass Storage
+'''
+
+
+class TestParseDevices(unittest.TestCase):
+
+    def test_lspci(self):
+        devices = bundleparser.parse_lspci(lspci)
+        self.assertEqual([d['address'] for d in devices], ['00:02.0', '00:14.0', '00:1f.3', '04:00.0'])
+
+        gpu = devices[0]
+        self.assertEqual(gpu['bus'], 'pci')
+        self.assertEqual(gpu['class'], '0300')
+        self.assertEqual((gpu['vendor'], gpu['device']), ('8086', '5916'))
+        self.assertEqual((gpu['subvendor'], gpu['subdevice']), ('17aa', '224f'))
+        self.assertEqual(gpu['driver'], 'i915')
+        self.assertTrue(gpu['description'].startswith('Intel Corporation HD Graphics 620'))
+
+    def test_lspci_without_driver(self):
+        audio = bundleparser.parse_lspci(lspci)[2]
+        self.assertEqual(audio['class'], '0403')
+        self.assertIsNone(audio['driver'])
+        self.assertIsNone(audio['subvendor'])
+        self.assertIsNone(audio['subdevice'])
+
+    def test_lspci_ids_lowercase(self):
+        wifi = bundleparser.parse_lspci(lspci)[3]
+        self.assertEqual((wifi['vendor'], wifi['device']), ('8086', '24fd'))
+        self.assertEqual((wifi['subvendor'], wifi['subdevice']), ('8086', '0130'))
+        self.assertEqual(bundleparser.device_category(wifi), 'wifi')
+
+    def test_lsusb(self):
+        devices = bundleparser.parse_lsusb(lsusb)
+        self.assertEqual([d['address'] for d in devices], ['001:003', '001:002', '002:004'])
+        for d in devices:
+            self.assertEqual(d['bus'], 'usb')
+            self.assertIsNone(d['driver'])
+
+        bt = devices[0]
+        self.assertEqual((bt['vendor'], bt['device']), ('8087', '0a2b'))
+        self.assertEqual(bt['class'], 'e0')
+        self.assertEqual(bt['description'], 'Intel Corp.')
+        self.assertEqual(bundleparser.device_category(bt), 'bluetooth')
+
+    def test_lsusb_interface_class(self):
+        devices = bundleparser.parse_lsusb(lsusb)
+        # The device class is kept if set, otherwise the interface class is used
+        self.assertEqual(devices[1]['class'], 'ef')
+        self.assertEqual(devices[2]['class'], '08')
+        self.assertIsNone(bundleparser.device_category(devices[2]))
+
+
+dbus_dump = {
+    'net.reactivated.Fprint' : {
+        '/net/reactivated/Fprint/Device/1' : {
+            'interfaces' : {'net.reactivated.Fprint.Device' : {'props' : {'name' : 'Validity VFS5011'}}},
+        },
+        '/net/reactivated/Fprint/Device/0' : {
+            'interfaces' : {'net.reactivated.Fprint.Device' : {'props' : {'name' : 'Synaptics'}}},
+        },
+        '/net/reactivated/Fprint/Manager' : {
+            'interfaces' : {'net.reactivated.Fprint.Manager' : {}},
+        },
+    },
+    'org.freedesktop.UPower' : {
+        '/org/freedesktop/UPower/devices/battery_BAT0' : {
+            'interfaces' : {'org.freedesktop.UPower.Device' : {}},
+        },
+        '/org/freedesktop/UPower' : {
+            'interfaces' : None,
+        },
+    },
+}
+
+
+class TestDBusIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = bundleparser.DBusIndex.load(io.BytesIO(json.dumps(dbus_dump).encode('utf-8')))
+
+    def test_load(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.services['/org/freedesktop/UPower'], 'org.freedesktop.UPower')
+
+    def test_find_objects(self):
+        self.assertEqual(sorted(self.index.find_objects('/net/reactivated/Fprint/Device/')),
+                         ['/net/reactivated/Fprint/Device/0', '/net/reactivated/Fprint/Device/1'])
+        self.assertEqual(sorted(self.index.find_objects('/org/freedesktop/UPower')),
+                         ['/org/freedesktop/UPower', '/org/freedesktop/UPower/devices/battery_BAT0'])
+        self.assertEqual(self.index.find_objects('/org/gnome'), {})
+
+    def test_find_interface(self):
+        readers = self.index.find_interface('net.reactivated.Fprint.Device')
+        self.assertEqual(sorted(readers), ['/net/reactivated/Fprint/Device/0', '/net/reactivated/Fprint/Device/1'])
+        self.assertEqual(list(self.index.find_interface('net.reactivated.Fprint.Device', '/net/reactivated/Fprint/Device/1')),
+                         ['/net/reactivated/Fprint/Device/1'])
+        self.assertEqual(list(self.index.find_interface('net.reactivated.Fprint.Manager')),
+                         ['/net/reactivated/Fprint/Manager'])
+        self.assertEqual(self.index.find_interface('org.freedesktop.NetworkManager'), {})
+
+
+def summary(tests=(), hwtable=None, sysinfo=None):
+    return {
+        'tests' : [{'name' : name, 'status' : status, 'style' : style} for name, status, style in tests],
+        'hwtable' : dict((field, {'type' : field.capitalize(), 'status' : status})
+                         for field, status in (hwtable or {}).items()),
+        'sysinfo' : sysinfo or {},
+    }
+
+
+class TestDiffSummaries(unittest.TestCase):
+
+    def test_unchanged(self):
+        old = summary([('wifi', 'PASS', 'GOOD')], {'wifi' : 'GOOD'}, {'BIOS' : '1.0'})
+        self.assertEqual(bundleparser.diff_summaries(old, old), [])
+
+    def test_test_regression(self):
+        old = summary([('wifi', 'PASS', 'GOOD'), ('suspend', 'FAIL', 'BAD')])
+        new = summary([('wifi', 'FAIL', 'BAD'), ('suspend', 'PASS', 'GOOD')])
+        changes = bundleparser.diff_summaries(old, new)
+        self.assertEqual([(c['kind'], c['name'], c['old'], c['new'], c['regression']) for c in changes],
+                         [('test', 'suspend', 'FAIL', 'PASS', False),
+                          ('test', 'wifi', 'PASS', 'FAIL', True)])
+
+    def test_added_and_removed_tests(self):
+        old = summary([('wifi', 'PASS', 'GOOD')])
+        new = summary([('suspend', 'FAIL', 'BAD')])
+        changes = dict((c['name'], c) for c in bundleparser.diff_summaries(old, new))
+        self.assertEqual((changes['wifi']['new'], changes['wifi']['regression']), (None, False))
+        self.assertEqual((changes['suspend']['old'], changes['suspend']['regression']), (None, True))
+
+    def test_hwtable_regression(self):
+        old = summary(hwtable={'wifi' : 'GOOD', 'bluetooth' : 'WARN', 'sound' : 'BAD'})
+        new = summary(hwtable={'wifi' : 'WARN', 'bluetooth' : 'GOOD', 'sound' : 'BAD'})
+        changes = dict((c['name'], c) for c in bundleparser.diff_summaries(old, new))
+        self.assertEqual(sorted(changes), ['Bluetooth', 'Wifi'])
+        self.assertTrue(changes['Wifi']['regression'])
+        self.assertFalse(changes['Bluetooth']['regression'])
+
+    def test_sysinfo_is_never_a_regression(self):
+        old = summary(sysinfo={'BIOS' : '1.0', 'Kernel' : '4.11'})
+        new = summary(sysinfo={'BIOS' : '1.1', 'Kernel' : '4.11'})
+        changes = bundleparser.diff_summaries(old, new)
+        self.assertEqual([(c['kind'], c['name'], c['old'], c['new'], c['regression']) for c in changes],
+                         [('sysinfo', 'BIOS', '1.0', '1.1', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
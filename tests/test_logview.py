@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from hwtestgrid import logview
+
+log = b''.join(b'line %03d %s\n' % (i, b'ERROR' if i % 10 == 0 else b'ok') for i in range(95))
+lines = log.splitlines(True)
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def build(self, data, step):
+        return logview.LogIndex.build(io.BytesIO(data), os.path.join(self.directory, 'log'), step)
+
+    def test_count_lines(self):
+        for step in (1, 7, 1000):
+            self.assertEqual(self.build(log, step).lines, 95)
+            self.assertEqual(self.build(b'', step).lines, 0)
+            self.assertEqual(self.build(b'a\nb', step).lines, 2)
+            self.assertEqual(self.build(b'\n\n', step).lines, 2)
+
+    def test_checkpoints(self):
+        index = self.build(log, 7)
+        self.assertEqual(len(index.offsets), 95 // 7 + 1)
+        for i, offset in enumerate(index.offsets):
+            self.assertEqual(offset, len(b''.join(lines[:i * 7])))
+
+    def test_read_lines(self):
+        for step in (1, 7, 1000):
+            index = self.build(log, step)
+            for start in (0, 6, 7, 8, 49, 90, 94, 95, 200):
+                self.assertEqual(list(index.read_lines(start, 10)), lines[start:start + 10])
+
+    def test_read_lines_negative(self):
+        index = self.build(log, 7)
+        self.assertRaises(ValueError, list, index.read_lines(-1, 10))
+
+    def test_tail(self):
+        index = self.build(log, 7)
+        self.assertEqual(list(index.tail(3)), lines[-3:])
+        self.assertEqual(list(index.tail(1000)), lines)
+        self.assertEqual(list(self.build(b'a\nb', 7).tail(1)), [b'b'])
+
+    def test_grep(self):
+        index = self.build(log, 7)
+        regex = re.compile('ERROR')
+        self.assertEqual([lineno for lineno, line in index.grep(regex)], list(range(0, 95, 10)))
+        self.assertEqual(list(index.grep(regex, 31, 2)), [(40, lines[40]), (50, lines[50])])
+
+    def test_grep_max_lines(self):
+        index = self.build(log, 7)
+        regex = re.compile('ERROR')
+        self.assertEqual([lineno for lineno, line in index.grep(regex, 15, max_lines=20)], [20, 30])
+        self.assertEqual([lineno for lineno, line in index.grep(regex, 35, max_lines=5)], [])
+        self.assertEqual([lineno for lineno, line in index.grep(regex, 85, max_lines=100)], [90])
+
+    def test_grep_long_lines(self):
+        data = b'x' * logview.GREP_LINE_LENGTH + b'ERROR\nERROR\n'
+        index = self.build(data, 7)
+        self.assertEqual([lineno for lineno, line in index.grep(re.compile('ERROR'))], [1])
+
+    def test_save_load(self):
+        index = self.build(log, 7)
+        index.save(index.fname + '.idx')
+        loaded = logview.LogIndex.load(index.fname)
+        self.assertEqual((loaded.step, loaded.lines, loaded.offsets), (7, 95, index.offsets))
+        self.assertEqual(list(loaded.read_lines(50, 2)), lines[50:52])
+
+
+class TestLogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_lookup(self):
+        cache = logview.LogCache(os.path.join(self.directory, 'cache'), 7, 1024 * 1024)
+        self.assertIsNone(cache.lookup(('bundle', 'debug.log')))
+        cache.build(('bundle', 'debug.log'), io.BytesIO(log))
+        index = cache.lookup(('bundle', 'debug.log'))
+        self.assertEqual(index.lines, 95)
+        self.assertEqual(list(index.tail(1)), lines[-1:])
+
+    def test_expire(self):
+        cache = logview.LogCache(self.directory, 7, len(log) * 2)
+        for i in range(3):
+            cache.build(('bundle', str(i)), io.BytesIO(log))
+        self.assertIsNone(cache.lookup(('bundle', '0')))
+        self.assertIsNotNone(cache.lookup(('bundle', '1')))
+        self.assertIsNotNone(cache.lookup(('bundle', '2')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from hwtestgrid import storage
+
+members = {
+    'run/sysinfo/pre/lspci' : b'00:02.0 VGA compatible controller\n' * 10,
+    'run/test-results/debug.log' : b''.join(b'line %d\n' % i for i in range(5000)),
+    'run/test-results/empty' : b'',
+}
+
+SPLIT_SIZE = 1024
+
+
+class TestBundleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = storage.BundleStore(self.root)
+        os.makedirs(self.store.hot)
+        os.makedirs(self.store.cold)
+
+        z = zipfile.ZipFile(self.store.hot_path('a.zip'), 'w', zipfile.ZIP_DEFLATED)
+        for name in sorted(members):
+            z.writestr(name, members[name])
+        z.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read_all(self, z):
+        return dict((name, z.read(name)) for name in z.namelist())
+
+    def test_freeze_round_trip(self):
+        self.store.freeze('a.zip', SPLIT_SIZE)
+        self.assertFalse(os.path.exists(self.store.hot_path('a.zip')))
+        self.assertTrue(self.store.exists('a.zip'))
+
+        z = self.store.open('a.zip')
+        self.assertIsInstance(z, storage.ColdBundle)
+        self.assertEqual(sorted(z.namelist()), sorted(members))
+        self.assertEqual(self.read_all(z), members)
+        for name in members:
+            self.assertEqual(z.getinfo(name).file_size, len(members[name]))
+        self.assertRaises(KeyError, z.getinfo, 'missing')
+        self.assertIsNone(z.testzip())
+
+        # Only the large member is stored separately
+        files = os.listdir(self.store.cold_path('a.zip'))
+        self.assertEqual(len([f for f in files if f.endswith(storage.COLD_SUFFIX)]), 1)
+        z.close()
+
+    def test_write_zip(self):
+        self.store.freeze('a.zip', SPLIT_SIZE)
+        z = self.store.open('a.zip')
+        target = os.path.join(self.root, 'out.zip')
+        z.write_zip(target)
+        z.close()
+
+        res = zipfile.ZipFile(target, 'r')
+        self.assertEqual(res.namelist(), sorted(members))
+        self.assertEqual(self.read_all(res), members)
+        res.close()
+
+    def test_freeze_old(self):
+        self.assertEqual(self.store.freeze_old(3600, SPLIT_SIZE), [])
+        self.assertEqual(self.store.freeze_old(0, SPLIT_SIZE), ['a.zip'])
+        self.assertEqual(self.store.freeze_old(0, SPLIT_SIZE), [])
+
+    def test_freeze_interrupted(self):
+        shutil.copy(self.store.hot_path('a.zip'), os.path.join(self.root, 'copy.zip'))
+        self.store.freeze('a.zip', SPLIT_SIZE)
+        # As if the hot copy had not been removed
+        shutil.copy(os.path.join(self.root, 'copy.zip'), self.store.hot_path('a.zip'))
+
+        self.assertEqual(self.store.freeze_old(0, SPLIT_SIZE), ['a.zip'])
+        self.assertFalse(os.path.exists(self.store.hot_path('a.zip')))
+        self.assertEqual(self.read_all(self.store.open('a.zip')), members)
+
+    def test_remove(self):
+        self.store.freeze('a.zip', SPLIT_SIZE)
+        self.store.remove('a.zip')
+        self.assertFalse(self.store.exists('a.zip'))
+        self.assertIsNone(self.store.open('a.zip'))
+
+    def test_missing_codec(self):
+        self.store.freeze('a.zip', SPLIT_SIZE)
+        fname = os.path.join(self.store.cold_path('a.zip'), 'index.json')
+        with open(fname, 'r') as f:
+            index = json.load(f)
+        for member in index['members']:
+            if member['file'] is not None:
+                member['codec'] = 'xz'
+        with open(fname, 'w') as f:
+            json.dump(index, f)
+
+        lzma = storage.lzma
+        storage.lzma = None
+        try:
+            z = self.store.open('a.zip')
+            self.assertRaises(IOError, z.read, 'run/test-results/debug.log')
+            self.assertEqual(z.read('run/sysinfo/pre/lspci'), members['run/sysinfo/pre/lspci'])
+        finally:
+            storage.lzma = lzma
+
+
+if __name__ == '__main__':
+    unittest.main()